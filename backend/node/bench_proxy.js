@@ -0,0 +1,69 @@
+// Measures the overhead the Node proxy hop adds on top of FastAPI.
+//
+// Requests the same endpoint directly from FastAPI and through this server,
+// with fresh client connections and with keep-alive, and reports latency
+// percentiles. Both servers must be running.
+//
+// The client-side settings only affect the connection to the first server.
+// The proxy's own hop to FastAPI is pooled unless server.js was started with
+// PYTHON_API_KEEPALIVE=0, which restores the old one-connection-per-request
+// behaviour. Run once in each mode to compare the hop before and after pooling.
+//
+// Usage: node bench_proxy.js [userId] [requests]
+//   (use a user with a stored plan; an unknown id measures the 404 path)
+const fetch = require('node-fetch');
+const http = require('http');
+
+const PYTHON_API_URL = process.env.PYTHON_API_URL || 'http://localhost:8000';
+const NODE_URL = process.env.NODE_URL || `http://localhost:${process.env.PORT || 3000}`;
+const userId = process.argv[2] || 'benchmark-user';
+const requests = parseInt(process.argv[3] || '200', 10);
+
+const percentile = (sorted, p) => sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+
+const run = async (label, url, agent) => {
+    const timings = [];
+    let bytes = 0;
+    // Warm up caches and, with keep-alive, the connection pool
+    for (let i = 0; i < 10; i++) {
+        await (await fetch(url, { agent })).text();
+    }
+    for (let i = 0; i < requests; i++) {
+        const start = process.hrtime.bigint();
+        const response = await fetch(url, { agent, headers: { 'Accept-Encoding': 'gzip' } });
+        bytes += (await response.buffer()).length;
+        timings.push(Number(process.hrtime.bigint() - start) / 1e6);
+    }
+    timings.sort((a, b) => a - b);
+    const mean = timings.reduce((sum, t) => sum + t, 0) / timings.length;
+    console.log(
+        `${label.padEnd(28)} mean ${mean.toFixed(2).padStart(7)} ms  ` +
+        `p50 ${percentile(timings, 0.5).toFixed(2).padStart(7)} ms  ` +
+        `p95 ${percentile(timings, 0.95).toFixed(2).padStart(7)} ms  ` +
+        `${(bytes / requests / 1024).toFixed(1)} KB/response`
+    );
+    return mean;
+};
+
+const main = async () => {
+    const path = `/api/writepath/plan/${userId}`;
+    console.log(`GET ${path}, ${requests} sequential requests per scenario\n`);
+
+    const freshAgent = new http.Agent({ keepAlive: false });
+    const keepAliveAgent = new http.Agent({ keepAlive: true });
+
+    const direct = await run('FastAPI direct', `${PYTHON_API_URL}${path}`, freshAgent);
+    const directKeepAlive = await run('FastAPI direct, keep-alive', `${PYTHON_API_URL}${path}`, keepAliveAgent);
+    const proxied = await run('Via Node proxy', `${NODE_URL}${path}`, freshAgent);
+    const proxiedKeepAlive = await run('Via Node proxy, keep-alive', `${NODE_URL}${path}`, keepAliveAgent);
+
+    console.log(`\nProxy hop overhead: ${(proxied - direct).toFixed(2)} ms (new client connections), ` +
+        `${(proxiedKeepAlive - directKeepAlive).toFixed(2)} ms (keep-alive clients)`);
+    console.log('Node -> FastAPI connections follow the server\'s PYTHON_API_KEEPALIVE setting ' +
+        '(pooled unless it was started with PYTHON_API_KEEPALIVE=0)');
+};
+
+main().catch((error) => {
+    console.error('Benchmark failed:', error.message);
+    process.exit(1);
+});
@@ -1,8 +1,45 @@
 const express = require('express');
 const cors = require('cors');
+const compression = require('compression');
 const fetch = require('node-fetch');
+const http = require('http');
 const app = express();
 
+const PYTHON_API_URL = process.env.PYTHON_API_URL || 'http://localhost:8000';
+
+// Reuse connections to FastAPI instead of opening a new one per request
+// (PYTHON_API_KEEPALIVE=0 restores one connection per request, e.g. for bench_proxy.js)
+const pythonAgent = new http.Agent({
+    keepAlive: process.env.PYTHON_API_KEEPALIVE !== '0',
+    maxSockets: parseInt(process.env.PYTHON_API_MAX_SOCKETS || '64', 10),
+    maxFreeSockets: 16,
+    // Idle sockets are dropped before uvicorn's 65s keep-alive timeout closes them
+    timeout: 60000
+});
+
+// The hop to FastAPI is local, so responses come back uncompressed (compress: false
+// stops node-fetch sending Accept-Encoding); compression() handles the browser side
+const pythonFetch = (path, options = {}) => fetch(`${PYTHON_API_URL}${path}`, { ...options, agent: pythonAgent, compress: false });
+
+// Stream a successful FastAPI response to the client as is, without parsing and re-encoding it
+const pipeResponse = (response, res) => {
+    res.set('Content-Type', response.headers.get('content-type'));
+    response.body.pipe(res);
+};
+
+// Headers FastAPI uses to apply per-client quotas and priority to AI requests
+const llmHeaders = (req) => {
+    const headers = {
+        'Content-Type': 'application/json',
+        'X-Forwarded-For': req.ip
+    };
+    if (req.get('X-Priority')) {
+        headers['X-Priority'] = req.get('X-Priority');
+    }
+    return headers;
+};
+
+app.use(compression());
 app.use(cors());
 app.use(express.json());
 app.use(express.static('../../frontend'));
@@ -15,7 +52,7 @@ const referenceAnswers = {
 
 // Original TOEFL submission endpoint
 app.post('/submit', async (req, res) => {
-    const { answer, questionId } = req.body;
+    const { answer, questionId, userId } = req.body;
     
     if (!answer || !questionId) {
         return res.status(400).json({ error: 'Answer and question ID are required' });
@@ -23,22 +60,28 @@ app.post('/submit', async (req, res) => {
     
     try {
         // Forward to Python backend with reference answer
-        const response = await fetch('http://localhost:8000/analyze', {
+        const response = await pythonFetch('/analyze', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers: llmHeaders(req),
             body: JSON.stringify({
                 userAnswer: answer,
                 referenceAnswer: referenceAnswers[questionId] || '',
-                questionId
+                questionId,
+                userId
             })
         });
         
+        if (response.status === 429) {
+            // AI quota exceeded; let the client know when to retry
+            res.set('Retry-After', response.headers.get('retry-after'));
+            return res.status(429).json(await response.json());
+        }
+        
         if (!response.ok) {
             throw new Error(`Python backend responded with ${response.status}`);
         }
         
-        const feedback = await response.json();
-        res.json(feedback);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Error:', error);
         res.status(500).json({ error: 'Analysis failed', details: error.message });
@@ -48,7 +91,7 @@ app.post('/submit', async (req, res) => {
 // WritePath API Proxies - User Profile Management
 app.post('/api/writepath/profile', async (req, res) => {
     try {
-        const response = await fetch('http://localhost:8000/api/writepath/profile', {
+        const response = await pythonFetch('/api/writepath/profile', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify(req.body)
@@ -59,8 +102,7 @@ app.post('/api/writepath/profile', async (req, res) => {
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Profile creation error:', error);
         res.status(500).json({ error: 'Profile creation failed', details: error.message });
@@ -69,15 +111,14 @@ app.post('/api/writepath/profile', async (req, res) => {
 
 app.get('/api/writepath/profile/:userId', async (req, res) => {
     try {
-        const response = await fetch(`http://localhost:8000/api/writepath/profile/${req.params.userId}`);
+        const response = await pythonFetch(`/api/writepath/profile/${req.params.userId}`);
         
         if (!response.ok) {
             const error = await response.json();
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Profile retrieval error:', error);
         res.status(500).json({ error: 'Profile retrieval failed', details: error.message });
@@ -86,7 +127,7 @@ app.get('/api/writepath/profile/:userId', async (req, res) => {
 
 app.put('/api/writepath/profile/:userId', async (req, res) => {
     try {
-        const response = await fetch(`http://localhost:8000/api/writepath/profile/${req.params.userId}`, {
+        const response = await pythonFetch(`/api/writepath/profile/${req.params.userId}`, {
             method: 'PUT',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify(req.body)
@@ -97,8 +138,7 @@ app.put('/api/writepath/profile/:userId', async (req, res) => {
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Profile update error:', error);
         res.status(500).json({ error: 'Profile update failed', details: error.message });
@@ -108,19 +148,21 @@ app.put('/api/writepath/profile/:userId', async (req, res) => {
 // WritePath API Proxies - Assessment
 app.post('/api/writepath/assess', async (req, res) => {
     try {
-        const response = await fetch('http://localhost:8000/api/writepath/assess', {
+        const response = await pythonFetch('/api/writepath/assess', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers: llmHeaders(req),
             body: JSON.stringify(req.body)
         });
         
         if (!response.ok) {
             const error = await response.json();
+            if (response.headers.get('retry-after')) {
+                res.set('Retry-After', response.headers.get('retry-after'));
+            }
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Assessment error:', error);
         res.status(500).json({ error: 'Assessment failed', details: error.message });
@@ -129,15 +171,14 @@ app.post('/api/writepath/assess', async (req, res) => {
 
 app.get('/api/writepath/results/:userId', async (req, res) => {
     try {
-        const response = await fetch(`http://localhost:8000/api/writepath/results/${req.params.userId}`);
+        const response = await pythonFetch(`/api/writepath/results/${req.params.userId}`);
         
         if (!response.ok) {
             const error = await response.json();
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Results retrieval error:', error);
         res.status(500).json({ error: 'Results retrieval failed', details: error.message });
@@ -147,19 +188,21 @@ app.get('/api/writepath/results/:userId', async (req, res) => {
 // WritePath API Proxies - Learning Plans
 app.post('/api/writepath/generate-plan', async (req, res) => {
     try {
-        const response = await fetch('http://localhost:8000/api/writepath/generate-plan', {
+        const response = await pythonFetch('/api/writepath/generate-plan', {
             method: 'POST',
-            headers: {'Content-Type': 'application/json'},
+            headers: llmHeaders(req),
             body: JSON.stringify(req.body)
         });
         
         if (!response.ok) {
             const error = await response.json();
+            if (response.headers.get('retry-after')) {
+                res.set('Retry-After', response.headers.get('retry-after'));
+            }
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Learning plan generation error:', error);
         res.status(500).json({ error: 'Learning plan generation failed', details: error.message });
@@ -168,15 +211,14 @@ app.post('/api/writepath/generate-plan', async (req, res) => {
 
 app.get('/api/writepath/plan/:userId', async (req, res) => {
     try {
-        const response = await fetch(`http://localhost:8000/api/writepath/plan/${req.params.userId}`);
+        const response = await pythonFetch(`/api/writepath/plan/${req.params.userId}`);
         
         if (!response.ok) {
             const error = await response.json();
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Learning plan retrieval error:', error);
         res.status(500).json({ error: 'Learning plan retrieval failed', details: error.message });
@@ -185,7 +227,7 @@ app.get('/api/writepath/plan/:userId', async (req, res) => {
 
 app.put('/api/writepath/plan/progress', async (req, res) => {
     try {
-        const response = await fetch('http://localhost:8000/api/writepath/plan/progress', {
+        const response = await pythonFetch('/api/writepath/plan/progress', {
             method: 'PUT',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify(req.body)
@@ -196,14 +238,32 @@ app.put('/api/writepath/plan/progress', async (req, res) => {
             return res.status(response.status).json(error);
         }
         
-        const result = await response.json();
-        res.json(result);
+        pipeResponse(response, res);
     } catch (error) {
         console.error('Progress update error:', error);
         res.status(500).json({ error: 'Progress update failed', details: error.message });
     }
 });
 
+// WritePath API Proxy - Data Export (streamed through without buffering)
+app.get('/api/writepath/export/:userId', async (req, res) => {
+    try {
+        const query = new URLSearchParams(req.query).toString();
+        const response = await pythonFetch(`/api/writepath/export/${req.params.userId}${query ? `?${query}` : ''}`);
+        
+        if (!response.ok) {
+            const error = await response.json();
+            return res.status(response.status).json(error);
+        }
+        
+        res.set('Content-Disposition', response.headers.get('content-disposition'));
+        pipeResponse(response, res);
+    } catch (error) {
+        console.error('Data export error:', error);
+        res.status(500).json({ error: 'Data export failed', details: error.message });
+    }
+});
+
 // Endpoint to serve the questions
 app.get('/questions/:id', (req, res) => {
     const id = req.params.id;
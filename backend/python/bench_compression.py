@@ -0,0 +1,285 @@
+"""Benchmark compressed text storage: on-disk size vs. read latency.
+
+Builds a corpus of the documents the app stores (7-day plans, assessment
+results, grading feedback and essays): the rows already in toefl.db, topped
+up with generated documents. Generated essays are assembled word by word
+from topic vocabulary and sentence frames, with learner errors mixed in, so
+they don't repeat the way a handful of stock sentences would; plans come
+from the real plan templates. Use ``--real-only`` to benchmark stored rows
+alone.
+
+The corpus is split in two. The trained dictionary is built from one half
+and every strategy is measured on the other, held-out half, so the trained
+result reflects documents the dictionary has never seen. Each strategy is
+stored in a throwaway SQLite database as plain TEXT, plain zlib or
+dictionary-compressed BLOBs, and the report gives database size and the
+time to read and decode every row.
+
+Usage:
+    python bench_compression.py [--documents 2000] [--real-only]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+
+import plan_templates
+import text_compression
+from text_compression import BUILTIN_DICTIONARY, MAX_DICTIONARY_SIZE, build_dictionary, decode_text, encode_text
+
+WEAK_AREAS = plan_templates.WEAK_AREAS
+LEVELS = plan_templates.PROFICIENCY_LEVELS
+
+TOPICS = {
+    "technology": ["smartphones", "social media", "online shopping", "video calls", "artificial intelligence"],
+    "education": ["online courses", "homework", "group projects", "university tuition", "standardized tests"],
+    "work": ["working from home", "part-time jobs", "job interviews", "long commutes", "teamwork"],
+    "environment": ["public transport", "recycling", "plastic bags", "electric cars", "city parks"],
+    "society": ["volunteering", "living in big cities", "traditional festivals", "fast food", "advertising"],
+    "personal": ["learning to cook", "traveling alone", "keeping a diary", "playing sports", "reading novels"],
+}
+SUBJECTS = ["many students", "young people", "my parents", "most employers", "some teachers", "my best friend",
+            "people in my country", "children", "older adults", "governments", "small companies", "my classmates"]
+VERBS = ["improves", "changes", "damages", "supports", "replaces", "encourages", "limits", "affects",
+         "creates", "reduces", "increases", "shapes"]
+OBJECTS = ["daily life", "communication skills", "mental health", "family relationships", "the economy",
+           "free time", "personal freedom", "job opportunities", "study habits", "the local community",
+           "creativity", "public safety"]
+ADJECTIVES = ["useful", "harmful", "expensive", "convenient", "stressful", "popular", "important", "difficult",
+              "necessary", "risky", "rewarding", "boring"]
+FRAMES = [
+    "{Connector} {topic} {verb} {object} in ways that {subject} did not expect.",
+    "I believe {topic} is {adjective} because it {verb} {object}.",
+    "When I was {age} years old, {subject} told me that {topic} was {adjective}.",
+    "According to a survey I read, {percent} percent of {subject} think {topic} is {adjective}.",
+    "{Connector} {subject} say that {topic} {verb} {object}, but I partly disagree.",
+    "In {city}, {topic} has become {adjective} over the last {years} years.",
+    "For example, my {relative} spends about {hours} hours a week on {topic}.",
+    "Without {topic}, {subject} would have less {object2} and more problems with {object}.",
+    "It is {adjective} to ignore how {topic} {verb} {object}.",
+    "{Connector} the main reason is that {topic} {verb} {object} for {subject}.",
+    "Some people may argue that {topic} is {adjective}, yet the evidence shows otherwise.",
+    "Last {season}, I tried {topic} myself and found it surprisingly {adjective}.",
+]
+CONNECTORS = ["However,", "Moreover,", "For instance,", "In addition,", "On the other hand,", "First of all,",
+              "Secondly,", "As a result,", "Nevertheless,", "Besides,", "To be honest,", "In my experience,"]
+CITIES = ["Seoul", "Taipei", "Lima", "Istanbul", "Hanoi", "Madrid", "Lagos", "Osaka", "Warsaw", "Bogota"]
+RELATIVES = ["brother", "sister", "uncle", "cousin", "grandmother", "roommate", "neighbor"]
+SEASONS = ["summer", "winter", "spring", "autumn", "semester", "year"]
+
+CORRECTION_REASONS = ["has a subject-verb agreement error", "is missing an article", "uses the wrong tense",
+                      "is a run-on sentence", "needs a comma after the introductory phrase",
+                      "uses an informal word choice", "has an unclear pronoun reference"]
+SUGGESTION_FRAMES = [
+    "Give a more specific example about {topic} in your {ordinal} body paragraph.",
+    "Your thesis about {topic} is clear, but restate it in different words in the conclusion.",
+    "Vary your sentence openings; {count} sentences start with the same phrase.",
+    "Use more precise vocabulary than '{adjective}' when describing {topic}.",
+    "Connect your {ordinal} paragraph to the thesis with a stronger topic sentence.",
+    "Explain why your example about {topic} supports your opinion instead of only describing it.",
+    "Check your {area} carefully; several sentences have similar problems.",
+]
+ANALYSIS_FRAMES = [
+    "The writer {quality} controls {area}, with {count} noticeable errors in the essay about {topic}.",
+    "{Area} is {quality} developed; the paragraph on {topic} {detail}.",
+    "Overall {area} shows {quality} progress, although {detail}.",
+]
+QUALITIES = ["generally", "partly", "inconsistently", "confidently", "only sometimes"]
+DETAILS = ["relies on general statements", "includes a relevant personal example", "repeats the same point twice",
+           "needs clearer transitions", "uses a good range of linking words", "drifts away from the prompt"]
+ORDINALS = ["first", "second", "third"]
+
+def _learner_errors(rng, sentence):
+    """Introduce the kinds of mistakes graded essays actually contain."""
+    if rng.random() < 0.15:
+        sentence = sentence.replace(" the ", " ", 1)
+    if rng.random() < 0.1:
+        sentence = sentence.replace(" is ", " are ", 1)
+    if rng.random() < 0.1:
+        sentence = sentence.replace("s ", " ", 1)
+    if rng.random() < 0.05:
+        sentence = sentence[0].lower() + sentence[1:]
+    return sentence
+
+def make_sentence(rng, topic):
+    values = {
+        "topic": topic,
+        "subject": rng.choice(SUBJECTS),
+        "verb": rng.choice(VERBS),
+        "object": rng.choice(OBJECTS),
+        "object2": rng.choice(OBJECTS),
+        "adjective": rng.choice(ADJECTIVES),
+        "Connector": rng.choice(CONNECTORS),
+        "age": rng.randint(6, 18),
+        "percent": rng.randint(10, 90),
+        "city": rng.choice(CITIES),
+        "years": rng.randint(2, 20),
+        "relative": rng.choice(RELATIVES),
+        "hours": rng.randint(1, 30),
+        "season": rng.choice(SEASONS),
+    }
+    sentence = rng.choice(FRAMES).format(**values)
+    return _learner_errors(rng, sentence[0].upper() + sentence[1:])
+
+def make_essay(rng):
+    topic = rng.choice(rng.choice(list(TOPICS.values())))
+    paragraphs = [
+        " ".join(make_sentence(rng, topic) for _ in range(rng.randint(3, 6)))
+        for _ in range(rng.randint(3, 5))
+    ]
+    return "\n\n".join(paragraphs)
+
+def make_feedback(rng, essay=None):
+    essay = essay or make_essay(rng)
+    sentences = [sentence for sentence in essay.replace("\n", " ").split(". ") if sentence]
+    topic = rng.choice(rng.choice(list(TOPICS.values())))
+    return json.dumps({
+        "corrections": [f'"{rng.choice(sentences).strip()}" {rng.choice(CORRECTION_REASONS)}.'
+                        for _ in range(rng.randint(2, 5))],
+        "suggestions": [rng.choice(SUGGESTION_FRAMES).format(
+            topic=topic, ordinal=rng.choice(ORDINALS), count=rng.randint(2, 5),
+            adjective=rng.choice(ADJECTIVES), area=plan_templates.area_label(rng.choice(WEAK_AREAS)))
+            for _ in range(rng.randint(2, 4))],
+        "score": rng.randint(10, 30)
+    }, indent=4)
+
+def make_assessment(rng):
+    topic = rng.choice(rng.choice(list(TOPICS.values())))
+    score = rng.randint(8, 30)
+    return json.dumps({
+        "proficiency_score": score,
+        "proficiency_level": "beginner" if score < 15 else "intermediate" if score < 24 else "advanced",
+        "weak_areas": rng.sample(WEAK_AREAS, 2),
+        "strengths": rng.sample([f"Clear opinion on {topic}", "Logical paragraphing", "Relevant examples",
+                                 "Good range of linking words", "Mostly accurate spelling"], 2),
+        "detailed_analysis": {
+            area: rng.choice(ANALYSIS_FRAMES).format(
+                area=plan_templates.area_label(area), Area=plan_templates.area_label(area).capitalize(),
+                quality=rng.choice(QUALITIES), count=rng.randint(1, 6), topic=topic, detail=rng.choice(DETAILS))
+            for area in WEAK_AREAS
+        },
+        "recommendations": [rng.choice(SUGGESTION_FRAMES).format(
+            topic=topic, ordinal=rng.choice(ORDINALS), count=rng.randint(2, 5),
+            adjective=rng.choice(ADJECTIVES), area=plan_templates.area_label(rng.choice(WEAK_AREAS)))
+            for _ in range(3)]
+    })
+
+def make_plan(rng):
+    """A template plan with personalized parts, as synthesize_learning_plan stores it."""
+    areas = rng.sample(WEAK_AREAS, 2)
+    level = rng.choice(LEVELS)
+    user_type = rng.choice(plan_templates.USER_TYPES)
+    goals = rng.sample(["pass the TOEFL", "write better emails", "improve essay structure", "academic writing",
+                        "expand vocabulary", "write with fewer mistakes", "prepare for university"], rng.randint(1, 2))
+    plan = plan_templates.build_base_plan(areas, level, user_type, goals)
+
+    topic = rng.choice(rng.choice(list(TOPICS.values())))
+    primary, secondary = (plan_templates.area_label(area) for area in areas)
+    plan["plan_summary"] = (f"This week targets your {primary} and {secondary} so that you can "
+                            f"{goals[0]}, using practice prompts about {topic}.")
+    plan["weekly_goal"] = f"Write a {rng.randint(2, 4)}-paragraph response on {topic} with at most {rng.randint(2, 6)} {primary} errors"
+    plan["success_metrics"] = [
+        f"Score {rng.randint(1, 4)} points higher on the day 7 assessment",
+        f"Use {rng.randint(5, 15)} new {secondary} techniques in your writing",
+        "Complete every daily task"
+    ]
+    plan["daily_tasks"][4]["tasks"][:2] = [
+        f"Draft an outline for a text about {topic} that helps you {goals[0]} (15 minutes)",
+        f"Rewrite your day {rng.randint(1, 4)} practice with a focus on {goals[-1]} (15 minutes)"
+    ]
+    return plan
+
+def load_stored_rows():
+    if not os.path.exists(text_compression.DB_PATH):
+        return []
+    rows = []
+    conn = sqlite3.connect(text_compression.DB_PATH)
+    try:
+        text_compression.init_dictionaries(conn)
+        for table, columns in text_compression.COMPRESSED_COLUMNS.items():
+            for column in columns:
+                for (value,) in conn.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL"):
+                    rows.append(decode_text(value))
+    finally:
+        conn.close()
+    return rows
+
+def build_corpus(count, seed=0, real_only=False):
+    rng = random.Random(seed)
+    # Real rows first so the corpus reflects what the app actually stores
+    corpus = load_stored_rows()
+    if not real_only:
+        generators = [lambda: json.dumps(make_plan(rng)), lambda: make_essay(rng),
+                      lambda: make_feedback(rng), lambda: make_assessment(rng)]
+        while len(corpus) < count:
+            corpus.append(rng.choice(generators)())
+    corpus = corpus[:count]
+    rng.shuffle(corpus)
+    return corpus
+
+def zlib_plain(text):
+    return zlib.compress(text.encode("utf-8"), 9)
+
+def measure(name, corpus, encode, decode):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE docs (id INTEGER PRIMARY KEY, body)")
+        conn.executemany("INSERT INTO docs (body) VALUES (?)", [(encode(text),) for text in corpus])
+        conn.commit()
+        conn.execute("VACUUM")
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        for (value,) in conn.execute("SELECT body FROM docs"):
+            decode(value)
+        elapsed = time.perf_counter() - start
+        conn.close()
+    finally:
+        os.remove(path)
+
+    per_row_us = elapsed / len(corpus) * 1e6
+    print(f"{name:<22} {size / 1024:>10.1f} KB {per_row_us:>12.1f} us/row")
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--real-only", action="store_true",
+                        help="Only use rows stored in toefl.db, no generated documents")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.documents, real_only=args.real_only)
+    if len(corpus) < 4:
+        sys.exit(f"Only {len(corpus)} stored documents; need at least 4 to split into training and test sets")
+
+    # The dictionary is trained on one half; every strategy is measured on the other
+    split = len(corpus) // 2
+    training, held_out = corpus[:split], corpus[split:]
+    raw_bytes = sum(len(text.encode("utf-8")) for text in held_out)
+    print(f"Corpus: {len(corpus)} documents; training on {len(training)}, "
+          f"measuring {len(held_out)} held-out ({raw_bytes / 1024:.1f} KB of text)\n")
+    print(f"{'storage':<22} {'db size':>13} {'read+decode':>18}")
+
+    baseline = measure("TEXT", held_out, lambda text: text, lambda value: value)
+    measure("zlib", held_out, zlib_plain, lambda value: zlib.decompress(value).decode("utf-8"))
+    builtin = measure("zlib + builtin dict", held_out, encode_text, decode_text)
+
+    # Built the way train_dictionary builds it, built-in vocabulary included
+    dictionary = (BUILTIN_DICTIONARY + build_dictionary(training))[-MAX_DICTIONARY_SIZE:]
+    dictionary_id = max(text_compression._dictionaries) + 1
+    text_compression._dictionaries[dictionary_id] = dictionary
+    text_compression._active_dictionary_id = dictionary_id
+    trained = measure("zlib + trained dict", held_out, encode_text, decode_text)
+
+    print(f"\nBuilt-in dictionary: {builtin / baseline:.0%} of TEXT size")
+    print(f"Trained dictionary ({len(dictionary)} bytes): {trained / baseline:.0%} of TEXT size")
+
+if __name__ == "__main__":
+    main()
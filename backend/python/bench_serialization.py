@@ -0,0 +1,106 @@
+"""Benchmark response serialization for large plan and results payloads.
+
+Compares three ways of turning stored JSON into a response body:
+
+    decode + jsonable_encoder + json   what FastAPI did by default
+    decode + orjson                    ORJSONResponse over parsed dicts
+    orjson.Fragment passthrough        stored JSON copied in without decoding
+
+Usage:
+    python bench_serialization.py [--assessments 200] [--iterations 200]
+"""
+import argparse
+import json
+import random
+import time
+
+import orjson
+
+from bench_compression import make_plan
+from serialization import HAS_FRAGMENT, stored_json
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+def make_assessment(rng):
+    return {
+        "proficiency_score": rng.randint(10, 30),
+        "proficiency_level": rng.choice(["beginner", "intermediate", "advanced"]),
+        "weak_areas": ["grammar", "vocabulary"],
+        "strengths": ["Clear thesis statement", "Good use of examples", "Logical paragraphing"],
+        "detailed_analysis": {
+            area: f"Detailed notes on {area}: " + "the writer shows developing control with some lapses. " * 4
+            for area in ["grammar", "vocabulary", "organization", "development", "language_use"]
+        },
+        "recommendations": [f"Recommendation {i}: practice targeted exercises daily" for i in range(3)]
+    }
+
+def build_stored_rows(count, seed=0):
+    """Rows as they come out of the database: JSON text columns."""
+    rng = random.Random(seed)
+    rows = []
+    for index in range(count):
+        assessment = make_assessment(rng)
+        rows.append((index, "initial", json.dumps(assessment), assessment["proficiency_score"],
+                     json.dumps(assessment["weak_areas"]), json.dumps(assessment["recommendations"]),
+                     "2025-05-31 14:21:11"))
+    return rows
+
+def results_payload(rows, load):
+    assessments = [{
+        "assessment_id": row[0],
+        "assessment_type": row[1],
+        "analysis_result": load(row[2]),
+        "proficiency_score": row[3],
+        "weak_areas": load(row[4]),
+        "recommendations": load(row[5]),
+        "timestamp": row[6]
+    } for row in rows]
+    return {"user_id": "u", "total_assessments": len(assessments),
+            "latest_assessment": assessments[0], "all_assessments": assessments}
+
+def plan_payload(plan_text, load):
+    return {"plan_id": 1, "learning_plan": load(plan_text),
+            "progress": load('{"completed_days": [1, 2], "current_day": 3, "completion_percentage": 28.6}'),
+            "created_at": "2025-05-31 14:21:11"}
+
+def timed(build, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        body = build()
+    return (time.perf_counter() - start) / iterations * 1000, len(body)
+
+def run(name, build_payload, iterations):
+    strategies = []
+    if jsonable_encoder is not None:
+        strategies.append(("decode + jsonable_encoder + json",
+                           lambda: json.dumps(jsonable_encoder(build_payload(json.loads))).encode("utf-8")))
+    strategies.append(("decode + orjson", lambda: orjson.dumps(build_payload(orjson.loads))))
+    if HAS_FRAGMENT:
+        strategies.append(("orjson.Fragment passthrough", lambda: orjson.dumps(build_payload(stored_json))))
+
+    print(f"\n{name}")
+    for label, build in strategies:
+        ms, size = timed(build, iterations)
+        print(f"  {label:<34} {ms:>8.3f} ms  ({size / 1024:.1f} KB)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--assessments", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    if jsonable_encoder is None:
+        print("fastapi not installed; skipping the jsonable_encoder baseline")
+    if not HAS_FRAGMENT:
+        print("orjson < 3.9 has no Fragment; skipping the passthrough strategy")
+
+    rows = build_stored_rows(args.assessments)
+    plan_text = json.dumps(make_plan(random.Random(0)))
+    run(f"GET /results ({args.assessments} assessments)", lambda load: results_payload(rows, load), args.iterations)
+    run("GET /plan", lambda load: plan_payload(plan_text, load), args.iterations * 10)
+
+if __name__ == "__main__":
+    main()
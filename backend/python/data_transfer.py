@@ -0,0 +1,300 @@
+"""Streaming export/import of WritePath data.
+
+Exports page through the tables with keyset pagination (``WHERE id > ?``),
+so only one page of rows is held in memory at a time no matter how large
+toefl.db grows. Imports read their input line by line and write it back
+with ``executemany`` in chunked transactions.
+
+Usage:
+    python data_transfer.py export --format ndjson > backup.ndjson
+    python data_transfer.py export --user-id <uuid> --output user.ndjson
+    python data_transfer.py export --format csv --table submissions > submissions.csv
+    python data_transfer.py import --new-ids user.ndjson
+    python data_transfer.py import --replace backup.ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import retention
+import schema
+import text_compression
+from text_compression import decode_text, encode_text
+
+DB_PATH = 'toefl.db'
+
+# Rows fetched per page while exporting
+PAGE_SIZE = 500
+# Rows written per transaction while importing
+BATCH_SIZE = 1000
+
+# Exported tables, parents first so imports satisfy foreign keys
+EXPORT_TABLES = ["user_profiles", "submissions", "assessment_results", "learning_paths"]
+
+# Column that ties each table to a user profile
+USER_COLUMNS = {
+    "user_profiles": "id",
+    "submissions": "user_id",
+    "assessment_results": "user_id",
+    "learning_paths": "user_id",
+}
+
+# Integer references to other exported tables, remapped when ids are reassigned
+PARENT_COLUMNS = {
+    "learning_paths": {"assessment_id": "assessment_results"},
+}
+
+def get_table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def iter_table_rows(conn: sqlite3.Connection, table: str, user_id: Optional[str] = None,
+                    page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """Yield the rows of ``table`` as dicts, one page at a time.
+
+    Submissions moved to the archive by the retention job are included as
+    ordinary submission rows, so an import brings them back as such.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    yield from _iter_stored_rows(conn, table, user_id, page_size)
+    if table == "submissions":
+        columns = get_table_columns(conn, table)
+        for row in retention.iter_archived_submissions(conn, user_id, page_size):
+            yield {column: row.get(column) for column in columns}
+
+def _iter_stored_rows(conn: sqlite3.Connection, table: str, user_id: Optional[str],
+                      page_size: int) -> Iterator[Dict]:
+
+    columns = get_table_columns(conn, table)
+    column_list = ", ".join(columns)
+    user_column = USER_COLUMNS[table]
+    if user_id is not None and user_column not in columns:
+        # Older databases have no user_id on submissions
+        return
+
+    last_id = None
+    while True:
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append(f"{user_column} = ?")
+            params.append(user_id)
+        if last_id is not None:
+            conditions.append("id > ?")
+            params.append(last_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = conn.execute(f"""
+            SELECT {column_list} FROM {table} {where}
+            ORDER BY id LIMIT ?
+        """, (*params, page_size)).fetchall()
+        if not rows:
+            return
+
+        for row in rows:
+            # Exports always carry plain text, whatever the storage format
+            yield {column: decode_text(value) if isinstance(value, bytes) else value
+                   for column, value in zip(columns, row)}
+        last_id = rows[-1][columns.index("id")]
+
+def export_ndjson(db_path: str = DB_PATH, user_id: Optional[str] = None,
+                  tables: Optional[List[str]] = None) -> Iterator[str]:
+    """Yield one ``{"table": ..., "row": ...}`` JSON line per exported row."""
+    conn = sqlite3.connect(db_path)
+    try:
+        text_compression.init_dictionaries(conn)
+        for table in tables or EXPORT_TABLES:
+            for row in iter_table_rows(conn, table, user_id):
+                yield json.dumps({"table": table, "row": row}, ensure_ascii=False) + "\n"
+    finally:
+        conn.close()
+
+def export_csv(table: str, db_path: str = DB_PATH, user_id: Optional[str] = None) -> Iterator[str]:
+    """Yield a single table as CSV, header first, one line per row."""
+    conn = sqlite3.connect(db_path)
+    try:
+        text_compression.init_dictionaries(conn)
+        columns = get_table_columns(conn, table)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        writer.writerow(columns)
+        for row in iter_table_rows(conn, table, user_id):
+            writer.writerow([row[column] for column in columns])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        # Header-only output for empty tables
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()
+
+def _assign_new_ids(conn: sqlite3.Connection, table: str, batch: List[Dict],
+                    id_maps: Dict[str, Dict[int, int]]) -> List[Dict]:
+    """Give a batch ids after the table's current ones and remap references to earlier tables."""
+    next_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    if sequence:
+        # AUTOINCREMENT never reuses ids, even those of deleted rows
+        next_id = max(next_id, sequence[0])
+
+    table_map = id_maps.setdefault(table, {})
+    remapped = []
+    for row in batch:
+        row = dict(row)
+        next_id += 1
+        if row.get("id") is not None:
+            table_map[int(row["id"])] = next_id
+        row["id"] = next_id
+        for column, parent in PARENT_COLUMNS.get(table, {}).items():
+            if row.get(column) is not None:
+                # References to rows that weren't imported are cleared rather than left pointing elsewhere
+                row[column] = id_maps.get(parent, {}).get(int(row[column]))
+        remapped.append(row)
+    return remapped
+
+def _insert_batch(conn: sqlite3.Connection, table: str, columns: List[str], batch: List[Dict],
+                  id_maps: Optional[Dict[str, Dict[int, int]]] = None, replace: bool = False) -> int:
+    """Insert one batch; returns the rows written (rows whose id already exists are skipped unless ``replace``)."""
+    placeholders = ", ".join("?" for _ in columns)
+    compressed = text_compression.COMPRESSED_COLUMNS.get(table, [])
+    if id_maps is not None:
+        # Take the write lock before reading the current ids so the new ones can't be claimed concurrently
+        conn.execute("BEGIN IMMEDIATE")
+        batch = _assign_new_ids(conn, table, batch, id_maps)
+    cursor = conn.executemany(f"""
+        INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO {table} ({', '.join(columns)})
+        VALUES ({placeholders})
+    """, [
+        tuple(encode_text(row.get(column)) if column in compressed else row.get(column) for column in columns)
+        for row in batch
+    ])
+    conn.commit()
+    return cursor.rowcount
+
+def import_rows(records: Iterable[tuple], db_path: str = DB_PATH, new_ids: bool = False,
+                batch_size: int = BATCH_SIZE, replace: bool = False) -> Dict[str, Dict[str, int]]:
+    """Write ``(table, row)`` records to the database in chunked transactions.
+
+    Rows keep their ids unless ``new_ids`` is set, in which case integer ids
+    are reassigned after the existing ones and references between imported
+    rows (a plan's ``assessment_id``) are remapped to match; references to
+    rows that are not part of the import are cleared. Profile ids are UUIDs
+    and are always kept. A row whose id is already taken is skipped, so an
+    import never overwrites other data, unless ``replace`` is set (restoring
+    a backup over the database it came from). Missing tables are created,
+    so a fresh database can be the target of a migration. Returns
+    ``{"imported": n, "skipped": n}`` per table.
+    """
+    conn = sqlite3.connect(db_path)
+    schema.init_schema(conn)
+    text_compression.init_dictionaries(conn)
+    counts = {}
+    table_columns = {}
+    # Old id -> new id per table, filled in when new_ids is set
+    id_maps = {} if new_ids else None
+    pending_table = None
+    batch = []
+
+    def flush():
+        written = _insert_batch(conn, pending_table, table_columns[pending_table], batch,
+                                id_maps if pending_table != "user_profiles" else None, replace)
+        table_counts = counts.setdefault(pending_table, {"imported": 0, "skipped": 0})
+        table_counts["imported"] += written
+        table_counts["skipped"] += len(batch) - written
+
+    try:
+        for table, row in records:
+            if table not in EXPORT_TABLES:
+                raise ValueError(f"Unknown table: {table}")
+            if table not in table_columns:
+                table_columns[table] = get_table_columns(conn, table)
+
+            if table != pending_table or len(batch) >= batch_size:
+                if batch:
+                    flush()
+                pending_table = table
+                batch = []
+            batch.append(row)
+
+        if batch:
+            flush()
+        return counts
+    finally:
+        conn.close()
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[tuple]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield record["table"], record["row"]
+
+def read_csv(lines: Iterable[str], table: str) -> Iterator[tuple]:
+    for row in csv.DictReader(lines):
+        # CSV has no NULL, so empty cells come back as None
+        yield table, {column: (value if value != "" else None) for column, value in row.items()}
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export or import WritePath data")
+    parser.add_argument("--db", default=DB_PATH, help="Path to the SQLite database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Stream data out as NDJSON or CSV")
+    export_parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    export_parser.add_argument("--user-id", help="Only export data belonging to this user")
+    export_parser.add_argument("--table", choices=EXPORT_TABLES,
+                               help="Table to export (required for CSV)")
+    export_parser.add_argument("--output", help="Output file (defaults to stdout)")
+
+    import_parser = subparsers.add_parser("import", help="Load an NDJSON or CSV export")
+    import_parser.add_argument("input", help="Input file, or - for stdin")
+    import_parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    import_parser.add_argument("--table", choices=EXPORT_TABLES,
+                               help="Table the CSV rows belong to (required for CSV)")
+    id_handling = import_parser.add_mutually_exclusive_group()
+    id_handling.add_argument("--new-ids", action="store_true",
+                             help="Assign new ids after the existing ones (to add a user's data to another database)")
+    id_handling.add_argument("--replace", action="store_true",
+                             help="Overwrite rows with the same id (to restore a backup of this database)")
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+    if args.format == "csv" and not args.table:
+        parser.error("--table is required for CSV")
+
+    if args.command == "export":
+        if args.format == "csv":
+            chunks = export_csv(args.table, args.db, args.user_id)
+        else:
+            chunks = export_ndjson(args.db, args.user_id, [args.table] if args.table else None)
+
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+    else:
+        source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8", newline="")
+        try:
+            records = read_csv(source, args.table) if args.format == "csv" else read_ndjson(source)
+            counts = import_rows(records, args.db, args.new_ids, args.batch_size, args.replace)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        for table, table_counts in counts.items():
+            print(f"Imported {table_counts['imported']} rows into {table}", file=sys.stderr)
+            if table_counts["skipped"]:
+                print(f"  skipped {table_counts['skipped']} rows whose id already exists "
+                      "(use --new-ids to add them, or --replace to overwrite)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Scheduling and per-user quotas for Gemini calls.
+
+Every model call goes through one scheduler, which:
+
+- charges the caller's token bucket (keyed on user id, or client address
+  for anonymous grading) and a larger bucket shared by everything coming
+  from the same client address, and rejects the call when either is empty;
+- queues calls by priority class and dispatches them with weighted fair
+  queueing, so interactive grading is served ahead of batch and background
+  work while no single user can monopolise a class;
+- runs at most ``LLM_MAX_CONCURRENCY`` calls at once on its own thread pool
+  (separate from the default executor, whose threads may be blocked in
+  ``run_sync`` waiting for these very calls);
+- records queue depth and wait times for ``metrics()``.
+
+Background work that someone starts waiting for (a learner opening a plan
+that is still being prepared) can be promoted to the interactive class with
+``promote``.
+
+Configuration (environment variables):
+    LLM_MAX_CONCURRENCY    concurrent model calls (default 4)
+    LLM_QUOTA_PER_MINUTE   sustained calls per user per minute (default 6)
+    LLM_QUOTA_BURST        calls a user can make back to back (default 10)
+    LLM_CLIENT_QUOTA_PER_MINUTE  sustained calls per client address (default 30)
+    LLM_CLIENT_QUOTA_BURST       calls a client address can make back to back (default 40)
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+
+# Share of dispatches each class gets when all are backlogged
+PRIORITY_WEIGHTS = {INTERACTIVE: 16, BATCH: 4, BACKGROUND: 1}
+# Background work is triggered by calls that were already charged
+CHARGED_PRIORITIES = {INTERACTIVE, BATCH}
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+QUOTA_PER_MINUTE = float(os.getenv("LLM_QUOTA_PER_MINUTE", "6"))
+QUOTA_BURST = float(os.getenv("LLM_QUOTA_BURST", "10"))
+# Several users can share an address (a school behind NAT), so its quota is larger
+CLIENT_QUOTA_PER_MINUTE = float(os.getenv("LLM_CLIENT_QUOTA_PER_MINUTE", "30"))
+CLIENT_QUOTA_BURST = float(os.getenv("LLM_CLIENT_QUOTA_BURST", "40"))
+
+# Wait times kept per class for percentile metrics
+WAIT_SAMPLES = 500
+# Hard cap on buckets kept per table; the least recently used are dropped first
+MAX_TRACKED_BUCKETS = 10000
+
+class QuotaExceededError(Exception):
+    def __init__(self, user_key: str, retry_after: float):
+        super().__init__(f"LLM quota exceeded for {user_key}")
+        self.user_key = user_key
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class BucketTable:
+    """Token buckets by key, least recently used first.
+
+    A bucket that has sat idle long enough to refill is the same as a new
+    one, so those are dropped from the old end as the table is used, and
+    the table never holds more than ``max_size`` buckets.
+    """
+    def __init__(self, rate_per_second: float, capacity: float, max_size: int = MAX_TRACKED_BUCKETS):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def get(self, key: str) -> TokenBucket:
+        self._prune()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _prune(self):
+        # Leaves room for one more bucket
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if len(self._buckets) < self.max_size and not oldest.is_full():
+                break
+            self._buckets.popitem(last=False)
+
+class _Job:
+    def __init__(self, fn: Callable, args: tuple, user_key: str, priority: str, tag: Optional[Hashable],
+                 future: asyncio.Future):
+        self.fn = fn
+        self.args = args
+        self.user_key = user_key
+        self.priority = priority
+        self.tag = tag
+        self.future = future
+        self.enqueued = time.monotonic()
+
+def _percentile(samples, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, quota_per_minute: float = QUOTA_PER_MINUTE,
+                 quota_burst: float = QUOTA_BURST, client_quota_per_minute: float = CLIENT_QUOTA_PER_MINUTE,
+                 client_quota_burst: float = CLIENT_QUOTA_BURST):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._buckets = BucketTable(quota_per_minute / 60, quota_burst)
+        self._client_buckets = BucketTable(client_quota_per_minute / 60, client_quota_burst)
+        # Priority that jobs with a promoted tag are queued at
+        self._promoted: Dict[Hashable, str] = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        # Weighted fair queueing state: virtual time and last finish tag per (priority, user) flow
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[tuple, float] = {}
+        self._running = 0
+        self._queued = {priority: 0 for priority in PRIORITY_WEIGHTS}
+        self._waits: Dict[str, Deque[float]] = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_WEIGHTS}
+        self._counters = {priority: {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+                          for priority in PRIORITY_WEIGHTS}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Set the event loop that ``run_sync`` callers on other threads submit to."""
+        self._loop = loop
+
+    def _charge(self, user_key: str, client_key: Optional[str], priority: str):
+        if priority not in CHARGED_PRIORITIES:
+            return
+        buckets = [self._buckets.get(user_key)]
+        if client_key is not None:
+            buckets.append(self._client_buckets.get(client_key))
+        # Only take tokens once every bucket has one, so a rejected call costs nothing
+        retry_after = max(bucket.wait_time() for bucket in buckets)
+        if retry_after:
+            self._counters[priority]["rejected"] += 1
+            raise QuotaExceededError(user_key, retry_after)
+        for bucket in buckets:
+            bucket.take()
+
+    def _enqueue(self, job: _Job):
+        flow = (job.priority, job.user_key)
+        finish_tag = max(self._virtual_time, self._finish_tags.get(flow, 0.0)) + 1 / PRIORITY_WEIGHTS[job.priority]
+        self._finish_tags[flow] = finish_tag
+        heapq.heappush(self._queue, (finish_tag, next(self._sequence), job))
+        self._queued[job.priority] += 1
+
+    async def submit(self, fn: Callable, *args, user_key: str, priority: str = INTERACTIVE,
+                     client_key: Optional[str] = None, tag: Optional[Hashable] = None):
+        """Queue ``fn(*args)`` and return its result once it has run.
+
+        ``client_key`` also charges the client address's bucket. Jobs with a
+        ``tag`` can later be raised to a higher class with ``promote``.
+        """
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError(f"Unknown priority: {priority}")
+        self._charge(user_key, client_key, priority)
+
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        if tag is not None and tag in self._promoted:
+            priority = self._promoted[tag]
+        job = _Job(fn, args, user_key, priority, tag, loop.create_future())
+        self._enqueue(job)
+        self._counters[priority]["submitted"] += 1
+
+        self._dispatch()
+        return await job.future
+
+    def run_sync(self, fn: Callable, *args, user_key: str, priority: str = INTERACTIVE,
+                 client_key: Optional[str] = None, tag: Optional[Hashable] = None):
+        """Blocking ``submit`` for code already running on an executor thread."""
+        if self._loop is None:
+            raise RuntimeError("LLM scheduler is not bound to an event loop")
+        return asyncio.run_coroutine_threadsafe(
+            self.submit(fn, *args, user_key=user_key, priority=priority, client_key=client_key, tag=tag),
+            self._loop
+        ).result()
+
+    def promote(self, tag: Hashable, priority: str = INTERACTIVE):
+        """Move queued jobs with ``tag``, and any submitted later, up to ``priority``.
+
+        Must be called on the scheduler's event loop. Promoted jobs are not
+        charged again.
+        """
+        self._promoted[tag] = priority
+        promoted = [entry for entry in self._queue
+                    if entry[2].tag == tag and PRIORITY_WEIGHTS[entry[2].priority] < PRIORITY_WEIGHTS[priority]]
+        if not promoted:
+            return
+        moved = {id(entry) for entry in promoted}
+        self._queue = [entry for entry in self._queue if id(entry) not in moved]
+        heapq.heapify(self._queue)
+        for _, _, job in promoted:
+            self._queued[job.priority] -= 1
+            job.priority = priority
+            self._enqueue(job)
+        self._dispatch()
+
+    def release(self, tag: Hashable):
+        """Forget a promotion once its jobs have run."""
+        self._promoted.pop(tag, None)
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency and self._queue:
+            finish_tag, _, job = heapq.heappop(self._queue)
+            self._queued[job.priority] -= 1
+            self._virtual_time = finish_tag
+            if job.future.cancelled():
+                # The caller gave up while queued
+                continue
+            self._running += 1
+            self._waits[job.priority].append(time.monotonic() - job.enqueued)
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+        if not self._queue:
+            # Idle: forget old finish tags so they don't grow without bound
+            self._finish_tags.clear()
+        elif len(self._finish_tags) > MAX_TRACKED_BUCKETS:
+            # Tags at or behind virtual time no longer affect scheduling
+            self._finish_tags = {flow: tag for flow, tag in self._finish_tags.items() if tag > self._virtual_time}
+
+    async def _execute(self, job: _Job):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, job.fn, *job.args)
+            self._counters[job.priority]["completed"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            self._counters[job.priority]["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._dispatch()
+
+    def metrics(self) -> Dict:
+        return {
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "tracked_users": len(self._buckets),
+            "tracked_clients": len(self._client_buckets),
+            "classes": {
+                priority: {
+                    "weight": PRIORITY_WEIGHTS[priority],
+                    "queue_depth": self._queued[priority],
+                    "wait_ms_p50": _percentile(self._waits[priority], 0.5),
+                    "wait_ms_p95": _percentile(self._waits[priority], 0.95),
+                    **self._counters[priority]
+                } for priority in PRIORITY_WEIGHTS
+            }
+        }
+
+scheduler = LLMScheduler()
@@ -1,19 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
 import sqlite3
 import os
 import json
 import google.generativeai as genai
 from dotenv import load_dotenv
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Any, Optional, List, Dict
 import uuid
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+import data_transfer
+import llm_scheduler
+import plan_prefetch
+import plan_templates
+import retention
+import schema
+from llm_scheduler import QuotaExceededError
+from serialization import stored_json
+import text_compression
+from text_compression import encode_text, decode_text
+
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI(title="Write Track Lite API")
+app = FastAPI(title="Write Track Lite API", default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -24,6 +43,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (plans, results, exports); Brotli when available, gzip otherwise
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 # Configure Gemini API
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
@@ -33,14 +58,70 @@ if not api_key:
 genai.configure(api_key=api_key)
 model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17')
 
+# Gemini calls are queued by priority and limited per user (see llm_scheduler.py)
+@app.exception_handler(QuotaExceededError)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceededError):
+    retry_after = max(1, round(exc.retry_after))
+    return ORJSONResponse(
+        status_code=429,
+        content={"detail": f"Too many AI requests. Please try again in {retry_after} seconds."},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def get_llm_priority(raw_request: Request) -> str:
+    # Scripts can opt into the batch class so they don't compete with interactive users
+    if raw_request.headers.get("x-priority", "").lower() == llm_scheduler.BATCH:
+        return llm_scheduler.BATCH
+    return llm_scheduler.INTERACTIVE
+
+# Peers allowed to report the browser's address in X-Forwarded-For (the Node proxy)
+TRUSTED_PROXIES = {address.strip() for address in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1,::ffff:127.0.0.1").split(",")}
+
+def get_client_key(raw_request: Request) -> str:
+    peer = raw_request.client.host if raw_request.client else "unknown"
+    # Anyone can send X-Forwarded-For, so only believe it from the proxy
+    forwarded_for = raw_request.headers.get("x-forwarded-for")
+    if forwarded_for and peer in TRUSTED_PROXIES:
+        return f"client:{forwarded_for.split(',')[0].strip()}"
+    return f"client:{peer}"
+
+def get_quota_key(user_id: Optional[str], client_key: str) -> str:
+    # Ids come from the request body, so only existing profiles get their own quota;
+    # anything else shares the client address's quota instead of minting fresh buckets
+    if user_id:
+        conn = sqlite3.connect('toefl.db')
+        try:
+            if conn.execute("SELECT 1 FROM user_profiles WHERE id = ?", (user_id,)).fetchone():
+                return user_id
+        finally:
+            conn.close()
+    return client_key
+
+def get_plan_tag(user_id: str, generation: int) -> tuple:
+    # Identifies a speculative plan's model call so it can be promoted once someone waits for it
+    return ("plan", user_id, generation)
+
+async def wait_for_prepared_plan(user_id: str):
+    """Wait for a plan being prepared in the background, promoting it to interactive."""
+    generation = plan_prefetch.pending_generation(user_id)
+    if generation is None:
+        return None
+    tag = get_plan_tag(user_id, generation)
+    llm_scheduler.scheduler.promote(tag)
+    try:
+        return await plan_prefetch.wait_for(user_id)
+    finally:
+        llm_scheduler.scheduler.release(tag)
+
 # Pydantic Models
 class SubmissionRequest(BaseModel):
     userAnswer: str
     referenceAnswer: str
     questionId: str
+    userId: Optional[str] = None
 
 class UserProfileRequest(BaseModel):
-    user_type: str  # "toefl", "general", "academic"
+    user_type: str  # "toefl", "general", "academic", "business"
     proficiency_level: Optional[str] = None  # Will be determined by assessment
     target_score: Optional[int] = None
     learning_goals: List[str]
@@ -56,6 +137,98 @@ class LearningPathUpdate(BaseModel):
     progress: Dict
     completed_tasks: List[str]
 
+# Response Models
+class MessageResponse(BaseModel):
+    message: str
+
+class ProfileCreatedResponse(BaseModel):
+    user_id: str
+    message: str
+    requires_assessment: bool
+
+class UserProfileResponse(BaseModel):
+    user_id: str
+    user_type: str
+    proficiency_level: Optional[str] = None
+    target_score: Optional[int] = None
+    learning_goals: List[str]
+    sample_writing: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+
+# Shapes below come from Gemini, so unexpected extra fields are passed through
+class AssessmentResult(BaseModel):
+    proficiency_score: int
+    proficiency_level: str
+    weak_areas: List[str]
+    strengths: List[str]
+    detailed_analysis: Dict[str, Any]
+    recommendations: List[str]
+
+    class Config:
+        extra = "allow"
+
+class AssessmentResponse(BaseModel):
+    assessment_id: int
+    assessment_result: AssessmentResult
+    message: str
+
+class AssessmentRecord(BaseModel):
+    assessment_id: int
+    assessment_type: str
+    analysis_result: AssessmentResult
+    proficiency_score: int
+    weak_areas: List[str]
+    recommendations: List[str]
+    timestamp: str
+
+class AssessmentResultsResponse(BaseModel):
+    user_id: str
+    total_assessments: int
+    latest_assessment: Optional[AssessmentRecord] = None
+    all_assessments: List[AssessmentRecord]
+
+class DailyTask(BaseModel):
+    day: int
+    title: str
+    focus_area: str
+    tasks: List[str]
+    learning_objective: str
+    estimated_time: str
+
+    class Config:
+        extra = "allow"
+
+class LearningPlan(BaseModel):
+    plan_title: str
+    plan_summary: str
+    daily_tasks: List[DailyTask]
+    weekly_goal: str
+    success_metrics: List[str]
+
+    class Config:
+        extra = "allow"
+
+class PlanProgress(BaseModel):
+    completed_days: List[int]
+    current_day: int
+    completion_percentage: float = 0
+
+class GeneratedPlanResponse(BaseModel):
+    plan_id: int
+    learning_plan: LearningPlan
+    message: str
+
+class LearningPlanResponse(BaseModel):
+    plan_id: int
+    learning_plan: LearningPlan
+    progress: PlanProgress
+    created_at: str
+
+class ProgressUpdateResponse(BaseModel):
+    message: str
+    progress: PlanProgress
+
 def get_system_prompt(user_answer, reference_answer):
     return f"""You are a TOEFL writing expert tutor. Analyze the following student's answer 
     compared to the reference answer. Provide feedback in the following JSON format:
@@ -75,7 +248,7 @@ def get_system_prompt(user_answer, reference_answer):
     """
 
 @app.post("/analyze")
-async def analyze_answer(request: SubmissionRequest):
+async def analyze_answer(request: SubmissionRequest, raw_request: Request):
     if not request.userAnswer:
         raise HTTPException(status_code=400, detail="User answer cannot be empty")
     
@@ -85,7 +258,13 @@ async def analyze_answer(request: SubmissionRequest):
     
     try:
         # Get Gemini's response
-        response = model.generate_content(prompt)
+        client_key = get_client_key(raw_request)
+        response = await llm_scheduler.scheduler.submit(
+            model.generate_content, prompt,
+            user_key=get_quota_key(request.userId, client_key),
+            client_key=client_key,
+            priority=get_llm_priority(raw_request)
+        )
         feedback_text = response.text
         print(f"Received response from Gemini API: {feedback_text[:100]}...")
         
@@ -120,9 +299,9 @@ async def analyze_answer(request: SubmissionRequest):
             conn = sqlite3.connect('toefl.db')
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO submissions (question_id, user_answer, feedback)
-                VALUES (?, ?, ?)
-            """, (request.questionId, request.userAnswer, feedback_text))
+                INSERT INTO submissions (question_id, user_id, user_answer, feedback)
+                VALUES (?, ?, ?, ?)
+            """, (request.questionId, request.userId, encode_text(request.userAnswer), encode_text(feedback_text)))
             conn.commit()
             print(f"Stored feedback in database for question ID: {request.questionId}")
         except sqlite3.Error as e:
@@ -131,12 +310,14 @@ async def analyze_answer(request: SubmissionRequest):
             conn.close()
         
         return feedback_json
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"ERROR in analyze_answer: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 # User Profile Management APIs
-@app.post("/api/writepath/profile")
+@app.post("/api/writepath/profile", response_model=ProfileCreatedResponse)
 async def create_user_profile(request: UserProfileRequest):
     try:
         # Generate a unique user ID
@@ -155,7 +336,7 @@ async def create_user_profile(request: UserProfileRequest):
             request.proficiency_level,
             request.target_score,
             json.dumps(request.learning_goals),
-            request.sample_writing
+            encode_text(request.sample_writing)
         ))
         
         conn.commit()
@@ -172,7 +353,7 @@ async def create_user_profile(request: UserProfileRequest):
     finally:
         conn.close()
 
-@app.get("/api/writepath/profile/{user_id}")
+@app.get("/api/writepath/profile/{user_id}", response_model=UserProfileResponse)
 async def get_user_profile(user_id: str):
     try:
         conn = sqlite3.connect('toefl.db')
@@ -194,7 +375,7 @@ async def get_user_profile(user_id: str):
             "proficiency_level": result[2],
             "target_score": result[3],
             "learning_goals": json.loads(result[4]) if result[4] else [],
-            "sample_writing": result[5],
+            "sample_writing": decode_text(result[5]),
             "created_at": result[6],
             "updated_at": result[7]
         }
@@ -206,7 +387,7 @@ async def get_user_profile(user_id: str):
     finally:
         conn.close()
 
-@app.put("/api/writepath/profile/{user_id}")
+@app.put("/api/writepath/profile/{user_id}", response_model=MessageResponse)
 async def update_user_profile(user_id: str, request: UserProfileRequest):
     try:
         conn = sqlite3.connect('toefl.db')
@@ -228,13 +409,16 @@ async def update_user_profile(user_id: str, request: UserProfileRequest):
             request.proficiency_level,
             request.target_score,
             json.dumps(request.learning_goals),
-            request.sample_writing,
+            encode_text(request.sample_writing),
             user_id
         ))
         
         conn.commit()
         print(f"Updated user profile for user_id: {user_id}")
         
+        # A plan being prepared from the old learning goals would be stale
+        plan_prefetch.cancel(user_id)
+        
         return {"message": "User profile updated successfully"}
     except sqlite3.Error as e:
         print(f"Database error in update_user_profile: {e}")
@@ -279,15 +463,22 @@ Please analyze the writing and respond with ONLY a JSON object in this exact for
 
 Return ONLY the JSON object with no additional text or formatting."""
 
-@app.post("/api/writepath/assess")
-async def conduct_assessment(request: AssessmentRequest):
+@app.post("/api/writepath/assess", response_model=AssessmentResponse)
+async def conduct_assessment(request: AssessmentRequest, raw_request: Request):
+    conn = None
     try:
         # Get the assessment prompt
         prompt = get_assessment_prompt(request.sample_writing, "writing_assessment")
         print(f"Conducting assessment for user_id: {request.user_id}")
         
         # Get AI analysis
-        response = model.generate_content(prompt)
+        client_key = get_client_key(raw_request)
+        response = await llm_scheduler.scheduler.submit(
+            model.generate_content, prompt,
+            user_key=get_quota_key(request.user_id, client_key),
+            client_key=client_key,
+            priority=get_llm_priority(raw_request)
+        )
         assessment_text = response.text
         
         # Clean up response if needed
@@ -300,6 +491,8 @@ async def conduct_assessment(request: AssessmentRequest):
             required_fields = ["proficiency_score", "proficiency_level", "weak_areas", "strengths", "detailed_analysis", "recommendations"]
             if not all(field in assessment_result for field in required_fields):
                 raise ValueError("Assessment response missing required fields")
+            # Field types must match the response model (ValidationError is a ValueError)
+            AssessmentResult.parse_obj(assessment_result)
         except (json.JSONDecodeError, ValueError) as e:
             print(f"Error parsing assessment response: {e}")
             # Provide a default assessment structure
@@ -333,8 +526,8 @@ async def conduct_assessment(request: AssessmentRequest):
         """, (
             request.user_id,
             request.assessment_type,
-            request.sample_writing,
-            json.dumps(assessment_result),
+            encode_text(request.sample_writing),
+            encode_text(json.dumps(assessment_result)),
             assessment_result["proficiency_score"],
             json.dumps(assessment_result["weak_areas"]),
             json.dumps(assessment_result["recommendations"])
@@ -352,19 +545,25 @@ async def conduct_assessment(request: AssessmentRequest):
         conn.commit()
         print(f"Assessment completed and stored with ID: {assessment_id}")
         
+        # The learner goes to their plan next, so start preparing it now
+        plan_prefetch.start(request.user_id, create_learning_plan)
+        
         return {
             "assessment_id": assessment_id,
             "assessment_result": assessment_result,
             "message": "Assessment completed successfully"
         }
         
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"ERROR in conduct_assessment: {e}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
     finally:
-        conn.close()
+        if conn:
+            conn.close()
 
-@app.get("/api/writepath/results/{user_id}")
+@app.get("/api/writepath/results/{user_id}", response_model=AssessmentResultsResponse)
 async def get_assessment_results(user_id: str):
     try:
         conn = sqlite3.connect('toefl.db')
@@ -375,7 +574,7 @@ async def get_assessment_results(user_id: str):
                    weak_areas, recommendations, timestamp
             FROM assessment_results 
             WHERE user_id = ? 
-            ORDER BY timestamp DESC
+            ORDER BY timestamp DESC, id DESC
         """, (user_id,))
         
         results = cursor.fetchall()
@@ -387,20 +586,21 @@ async def get_assessment_results(user_id: str):
             assessment = {
                 "assessment_id": result[0],
                 "assessment_type": result[1],
-                "analysis_result": json.loads(result[2]) if result[2] else {},
+                "analysis_result": stored_json(decode_text(result[2]), "{}"),
                 "proficiency_score": result[3],
-                "weak_areas": json.loads(result[4]) if result[4] else [],
-                "recommendations": json.loads(result[5]) if result[5] else [],
+                "weak_areas": stored_json(result[4], "[]"),
+                "recommendations": stored_json(result[5], "[]"),
                 "timestamp": result[6]
             }
             assessments.append(assessment)
         
-        return {
+        # Stored JSON is passed through as is, so skip response model validation
+        return ORJSONResponse(content={
             "user_id": user_id,
             "total_assessments": len(assessments),
             "latest_assessment": assessments[0] if assessments else None,
             "all_assessments": assessments
-        }
+        })
         
     except sqlite3.Error as e:
         print(f"Database error in get_assessment_results: {e}")
@@ -409,128 +609,21 @@ async def get_assessment_results(user_id: str):
         conn.close()
 
 # Learning Path Generation APIs
-def get_learning_plan_prompt(assessment_result, learning_goals, user_type):
-    weak_areas = ", ".join(assessment_result["weak_areas"])
-    goals = ", ".join(learning_goals)
-    
-    return f"""You are an expert English writing instructor. Create a personalized 7-day learning plan based on the student's assessment results.
-
-Student Profile:
-- Focus Area: {user_type}
-- Proficiency Level: {assessment_result["proficiency_level"]}
-- Score: {assessment_result["proficiency_score"]}/30
-- Weak Areas: {weak_areas}
-- Learning Goals: {goals}
-
-Create a structured 7-day plan following this format. Return ONLY a JSON object:
-{{
-    "plan_title": "Your Personalized 7-Day Writing Improvement Plan",
-    "plan_summary": "Brief overview of what this plan will achieve",
-    "daily_tasks": [
-        {{
-            "day": 1,
-            "title": "Focus on Primary Weak Area",
-            "focus_area": "primary weak area from assessment",
-            "tasks": [
-                "Specific task 1 (15-20 minutes)",
-                "Specific task 2 (15-20 minutes)", 
-                "Writing practice (20-30 minutes)"
-            ],
-            "learning_objective": "What the student will achieve today",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 2,
-            "title": "Continue Primary Focus",
-            "focus_area": "same as day 1 but different exercises",
-            "tasks": [
-                "Progressive task 1",
-                "Progressive task 2",
-                "Writing practice"
-            ],
-            "learning_objective": "Build on day 1 progress",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 3,
-            "title": "Secondary Weak Area",
-            "focus_area": "secondary weak area from assessment",
-            "tasks": [
-                "Specific task 1",
-                "Specific task 2",
-                "Writing practice"
-            ],
-            "learning_objective": "Address secondary weakness",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 4,
-            "title": "Strengthen Secondary Area",
-            "focus_area": "continue secondary area",
-            "tasks": [
-                "Progressive task 1",
-                "Progressive task 2", 
-                "Writing practice"
-            ],
-            "learning_objective": "Consolidate secondary improvements",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 5,
-            "title": "Goal-Aligned Practice",
-            "focus_area": "user's specific learning goals",
-            "tasks": [
-                "Goal-specific task 1",
-                "Goal-specific task 2",
-                "Comprehensive writing practice"
-            ],
-            "learning_objective": "Apply improvements to personal goals",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 6,
-            "title": "Integration & Practice",
-            "focus_area": "combine all improvements",
-            "tasks": [
-                "Integrated practice task 1",
-                "Integrated practice task 2",
-                "Full writing exercise"
-            ],
-            "learning_objective": "Synthesize all learning",
-            "estimated_time": "60 minutes"
-        }},
-        {{
-            "day": 7,
-            "title": "Review & Assessment",
-            "focus_area": "evaluation and next steps",
-            "tasks": [
-                "Review week's progress",
-                "Complete practice assessment",
-                "Plan next steps"
-            ],
-            "learning_objective": "Evaluate progress and plan continuation",
-            "estimated_time": "60 minutes"
-        }}
-    ],
-    "weekly_goal": "Primary objective for the week",
-    "success_metrics": [
-        "Measurable outcome 1",
-        "Measurable outcome 2",
-        "Measurable outcome 3"
-    ]
-}}
-
-Focus on practical, actionable tasks that directly address the identified weak areas and align with the student's goals."""
-
-@app.post("/api/writepath/generate-plan")
-async def generate_learning_plan(request: dict):
+def create_learning_plan(user_id: str, generation: Optional[int] = None, regenerate: bool = False,
+                         priority: str = llm_scheduler.INTERACTIVE, client_key: Optional[str] = None):
+    """Build and store a plan from the user's latest assessment; returns (plan_id, plan).
+
+    A plan already built from the latest assessment (e.g. prepared in the
+    background) is returned as is unless ``regenerate`` is set. Speculative
+    runs pass their ``generation``, are scheduled as background work (until
+    a request starts waiting for them) and store nothing once superseded.
+    """
+    tag = None
+    if generation is not None:
+        priority = llm_scheduler.BACKGROUND
+        tag = get_plan_tag(user_id, generation)
+    conn = sqlite3.connect('toefl.db')
     try:
-        user_id = request.get("user_id")
-        if not user_id:
-            raise HTTPException(status_code=400, detail="User ID is required")
-        
-        # Get user profile and latest assessment
-        conn = sqlite3.connect('toefl.db')
         cursor = conn.cursor()
         
         # Get user profile
@@ -547,60 +640,53 @@ async def generate_learning_plan(request: dict):
         
         # Get latest assessment
         cursor.execute("""
-            SELECT analysis_result FROM assessment_results 
-            WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1
+            SELECT id, analysis_result FROM assessment_results 
+            WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1
         """, (user_id,))
         assessment_result = cursor.fetchone()
         
         if not assessment_result:
             raise HTTPException(status_code=404, detail="No assessment found. Please complete assessment first.")
         
-        assessment_data = json.loads(assessment_result[0])
-        
-        # Generate learning plan using AI
-        prompt = get_learning_plan_prompt(assessment_data, learning_goals, user_type)
-        print(f"Generating learning plan for user: {user_id}")
+        assessment_id = assessment_result[0]
         
-        response = model.generate_content(prompt)
-        plan_text = response.text
+        # Reuse a plan already built from this assessment
+        if not regenerate:
+            cursor.execute("""
+                SELECT id, path_data FROM learning_paths 
+                WHERE user_id = ? AND assessment_id = ?
+                ORDER BY created_at DESC, id DESC LIMIT 1
+            """, (user_id, assessment_id))
+            existing_plan = cursor.fetchone()
+            if existing_plan:
+                return existing_plan[0], json.loads(decode_text(existing_plan[1]))
         
-        # Clean up response
-        if plan_text.startswith("```json") or plan_text.startswith('```'):
-            plan_text = plan_text.replace('```json', '').replace('```', '').strip()
+        assessment_data = json.loads(decode_text(assessment_result[1]))
         
-        try:
-            learning_plan = json.loads(plan_text)
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error parsing learning plan response: {e}")
-            # Provide a default 7-day plan
-            learning_plan = {
-                "plan_title": "Your Personalized 7-Day Writing Improvement Plan",
-                "plan_summary": f"A focused plan to improve your {', '.join(assessment_data['weak_areas'][:2])} skills",
-                "daily_tasks": [
-                    {
-                        "day": i + 1,
-                        "title": f"Day {i + 1}: Writing Practice",
-                        "focus_area": assessment_data['weak_areas'][0] if assessment_data['weak_areas'] else "general writing",
-                        "tasks": [
-                            "Practice writing exercises",
-                            "Review grammar rules", 
-                            "Complete writing prompt"
-                        ],
-                        "learning_objective": f"Improve {assessment_data['weak_areas'][0] if assessment_data['weak_areas'] else 'writing skills'}",
-                        "estimated_time": "60 minutes"
-                    } for i in range(7)
-                ],
-                "weekly_goal": "Improve overall writing proficiency",
-                "success_metrics": ["Complete daily tasks", "Show improvement in weak areas"]
-            }
+        # Build the plan from templates, asking the AI only for the personal parts
+        print(f"Generating learning plan for user: {user_id}")
+        learning_plan = plan_templates.synthesize_learning_plan(
+            conn, assessment_data, learning_goals, user_type,
+            lambda prompt: llm_scheduler.scheduler.run_sync(
+                model.generate_content, prompt, user_key=user_id, priority=priority,
+                client_key=client_key, tag=tag
+            ).text,
+            refresh=regenerate
+        )
+        
+        if not plan_prefetch.is_current(user_id, generation):
+            print(f"Discarding superseded learning plan for user: {user_id}")
+            conn.commit()
+            return None
         
         # Store learning plan in database
         cursor.execute("""
-            INSERT INTO learning_paths (user_id, path_data, progress, weak_areas, recommendations)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO learning_paths (user_id, assessment_id, path_data, progress, weak_areas, recommendations)
+            VALUES (?, ?, ?, ?, ?, ?)
         """, (
             user_id,
-            json.dumps(learning_plan),
+            assessment_id,
+            encode_text(json.dumps(learning_plan)),
             json.dumps({"completed_days": [], "current_day": 1, "completion_percentage": 0}),
             json.dumps(assessment_data["weak_areas"]),
             json.dumps(assessment_data["recommendations"])
@@ -610,21 +696,50 @@ async def generate_learning_plan(request: dict):
         conn.commit()
         
         print(f"Learning plan generated and stored with ID: {plan_id}")
+        return plan_id, learning_plan
+    finally:
+        conn.close()
+
+@app.post("/api/writepath/generate-plan", response_model=GeneratedPlanResponse)
+async def generate_learning_plan(request: dict, raw_request: Request):
+    user_id = request.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="User ID is required")
+    regenerate = bool(request.get("regenerate", False))
+    
+    try:
+        # Attach to the plan being prepared since the assessment, if any
+        result = None if regenerate else await wait_for_prepared_plan(user_id)
+        if result is None:
+            if regenerate:
+                plan_prefetch.cancel(user_id)
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                None, create_learning_plan, user_id, None, regenerate,
+                get_llm_priority(raw_request), get_client_key(raw_request)
+            )
+        plan_id, learning_plan = result
         
-        return {
+        # Plans are built from validated templates, so skip response model validation
+        return ORJSONResponse(content={
             "plan_id": plan_id,
             "learning_plan": learning_plan,
             "message": "Learning plan generated successfully"
-        }
+        })
         
+    except HTTPException:
+        raise
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"ERROR in generate_learning_plan: {e}")
         raise HTTPException(status_code=500, detail=f"Plan generation failed: {str(e)}")
-    finally:
-        conn.close()
 
-@app.get("/api/writepath/plan/{user_id}")
+@app.get("/api/writepath/plan/{user_id}", response_model=LearningPlanResponse)
 async def get_learning_plan(user_id: str):
+    # A plan still being prepared after the assessment is about to exist
+    await wait_for_prepared_plan(user_id)
+    
     try:
         conn = sqlite3.connect('toefl.db')
         cursor = conn.cursor()
@@ -633,7 +748,7 @@ async def get_learning_plan(user_id: str):
             SELECT id, path_data, progress, created_at 
             FROM learning_paths 
             WHERE user_id = ? 
-            ORDER BY created_at DESC 
+            ORDER BY created_at DESC, id DESC
             LIMIT 1
         """, (user_id,))
         
@@ -643,12 +758,13 @@ async def get_learning_plan(user_id: str):
         
         plan_id, path_data, progress, created_at = result
         
-        return {
+        # Stored JSON is passed through as is, so skip response model validation
+        return ORJSONResponse(content={
             "plan_id": plan_id,
-            "learning_plan": json.loads(path_data) if path_data else {},
-            "progress": json.loads(progress) if progress else {},
+            "learning_plan": stored_json(decode_text(path_data), "{}"),
+            "progress": stored_json(progress, "{}"),
             "created_at": created_at
-        }
+        })
         
     except sqlite3.Error as e:
         print(f"Database error in get_learning_plan: {e}")
@@ -656,7 +772,7 @@ async def get_learning_plan(user_id: str):
     finally:
         conn.close()
 
-@app.put("/api/writepath/plan/progress")
+@app.put("/api/writepath/plan/progress", response_model=ProgressUpdateResponse)
 async def update_plan_progress(request: dict):
     try:
         user_id = request.get("user_id")
@@ -672,7 +788,7 @@ async def update_plan_progress(request: dict):
         cursor.execute("""
             SELECT id, progress FROM learning_paths 
             WHERE user_id = ? 
-            ORDER BY created_at DESC 
+            ORDER BY created_at DESC, id DESC
             LIMIT 1
         """, (user_id,))
         
@@ -709,95 +825,60 @@ async def update_plan_progress(request: dict):
     finally:
         conn.close()
 
+# LLM Scheduler Metrics
+@app.get("/api/llm/metrics")
+async def get_llm_metrics():
+    return llm_scheduler.scheduler.metrics()
+
+# Data Export APIs
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def stream_export(format: str, table: Optional[str], user_id: str, filename: str):
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+    if table is not None and table not in data_transfer.EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table: {table}")
+    if format == "csv" and table is None:
+        raise HTTPException(status_code=400, detail="A table is required for CSV export")
+    
+    if format == "csv":
+        chunks = data_transfer.export_csv(table, user_id=user_id)
+    else:
+        chunks = data_transfer.export_ndjson(user_id=user_id, tables=[table] if table else None)
+    
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+EXPORT_RESPONSES = {200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}}
+
+# Whole-database exports contain every user's writing, so they are only
+# available from the data_transfer.py CLI
+@app.get("/api/writepath/export/{user_id}", response_class=StreamingResponse, responses=EXPORT_RESPONSES)
+async def export_user_data(user_id: str, format: str = "ndjson", table: Optional[str] = None):
+    try:
+        conn = sqlite3.connect('toefl.db')
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM user_profiles WHERE id = ?", (user_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="User profile not found")
+    except sqlite3.Error as e:
+        print(f"Database error in export_user_data: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        conn.close()
+    
+    return stream_export(format, table, user_id, f"writepath_{user_id}")
+
 # Database initialization
 def init_db():
     try:
         conn = sqlite3.connect('toefl.db')
         cursor = conn.cursor()
         
-        # Original submissions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS submissions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                question_id TEXT,
-                user_answer TEXT,
-                feedback TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # User profiles table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                id TEXT PRIMARY KEY,
-                user_type TEXT NOT NULL,
-                proficiency_level TEXT,
-                target_score INTEGER,
-                learning_goals TEXT, -- JSON array
-                sample_writing TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Learning paths table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS learning_paths (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                path_data TEXT, -- JSON object
-                progress TEXT, -- JSON object
-                weak_areas TEXT, -- JSON array
-                recommendations TEXT, -- JSON array
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES user_profiles (id)
-            )
-        """)
-        
-        # Practice sessions table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS practice_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                session_type TEXT,
-                questions_attempted TEXT, -- JSON array
-                completion_status TEXT,
-                performance_metrics TEXT, -- JSON object
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES user_profiles (id)
-            )
-        """)
-        
-        # Expanded questions bank
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS questions_bank (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT,
-                difficulty_level TEXT,
-                question_text TEXT,
-                reference_answer TEXT,
-                learning_objectives TEXT, -- JSON array
-                tags TEXT, -- JSON array
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Assessment results table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS assessment_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                assessment_type TEXT,
-                sample_writing TEXT,
-                analysis_result TEXT, -- JSON object
-                proficiency_score INTEGER,
-                weak_areas TEXT, -- JSON array
-                recommendations TEXT, -- JSON array
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES user_profiles (id)
-            )
-        """)
+        schema.init_schema(conn)
         
         # Insert some default questions if table is empty
         cursor.execute("SELECT COUNT(*) FROM questions_bank")
@@ -829,18 +910,40 @@ def init_db():
             """, default_questions)
         
         conn.commit()
+        
+        # Trained dictionaries for compressed text columns
+        text_compression.init_dictionaries(conn)
+        
+        # Cache of generated learning plans by profile signature
+        plan_templates.init_plan_cache(conn)
+        
+        # Cold storage for submissions moved out by the retention job
+        retention.init_archive(conn)
+        conn.commit()
         print("Database initialized successfully with all tables")
     except sqlite3.Error as e:
         print(f"Database initialization error: {e}")
     finally:
         conn.close()
 
-# Initialize database on startup
+# Initialize database and start the retention job on startup
+retention_task = None
+
 @app.on_event("startup")
 async def startup_event():
+    global retention_task
     init_db()
+    llm_scheduler.scheduler.bind_loop(asyncio.get_running_loop())
+    retention_task = asyncio.create_task(retention.retention_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if retention_task:
+        retention_task.cancel()
+    plan_prefetch.cancel_all()
 
 if __name__ == "__main__":
     import uvicorn
     init_db()
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # Keep idle connections open longer than the Node proxy's pooled sockets
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, timeout_keep_alive=65) 
\ No newline at end of file
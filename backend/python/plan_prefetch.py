@@ -0,0 +1,86 @@
+"""Speculative learning-plan generation after an assessment.
+
+Learners always go from the assessment straight to their plan, so the plan
+is generated in the background as soon as the assessment is stored. A plan
+request that arrives while that is still running attaches to it instead of
+starting a second generation.
+
+Each start gets a new generation number, never reused. A generation only
+stores its plan if it is still the current one, so cancelling (or starting a
+newer generation) also discards a model call that is already in flight on the
+executor thread. Users are only tracked while a generation is pending.
+"""
+import asyncio
+import itertools
+from typing import Callable, Dict, Optional
+
+_tasks: Dict[str, asyncio.Task] = {}
+_generations: Dict[str, int] = {}
+_next_generation = itertools.count(1)
+
+def is_current(user_id: str, generation: Optional[int]) -> bool:
+    """Whether a generation may still store its result (None means not speculative)."""
+    return generation is None or _generations.get(user_id) == generation
+
+async def _run(user_id: str, generation: int, generate: Callable):
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(None, generate, user_id, generation)
+        print(f"Prepared learning plan for user: {user_id}")
+        return result
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Speculative plan generation failed for user {user_id}: {e}")
+        return None
+
+def start(user_id: str, generate: Callable) -> asyncio.Task:
+    """Start generating a plan in the background, superseding any earlier run.
+
+    ``generate(user_id, generation)`` runs on the default executor and should
+    check ``is_current`` before storing anything.
+    """
+    cancel(user_id)
+    generation = next(_next_generation)
+    _generations[user_id] = generation
+
+    task = asyncio.get_running_loop().create_task(_run(user_id, generation, generate))
+    _tasks[user_id] = task
+
+    def forget(finished: asyncio.Task):
+        if _tasks.get(user_id) is finished:
+            del _tasks[user_id]
+            del _generations[user_id]
+
+    task.add_done_callback(forget)
+    return task
+
+def cancel(user_id: str):
+    """Cancel a pending generation; a model call already in flight is discarded."""
+    _generations.pop(user_id, None)
+    task = _tasks.pop(user_id, None)
+    if task:
+        task.cancel()
+
+def cancel_all():
+    for user_id in list(_tasks):
+        cancel(user_id)
+
+def pending_generation(user_id: str) -> Optional[int]:
+    """The generation still being prepared for a user, or None if there is none."""
+    if user_id not in _tasks:
+        return None
+    return _generations.get(user_id)
+
+async def wait_for(user_id: str):
+    """Wait for a pending generation and return its result, or None if there is none."""
+    task = _tasks.get(user_id)
+    if task is None:
+        return None
+    try:
+        # Shielded so a disconnecting client doesn't cancel the shared generation
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled():
+            return None
+        raise
@@ -0,0 +1,415 @@
+"""Template-based synthesis of 7-day learning plans.
+
+Every plan has the same shape: two days on the primary weak area, two on
+the secondary one, a goal-aligned day, an integration day and a review
+day. Instead of having Gemini write all of that from scratch, the daily
+tasks come from a library of validated day templates indexed by
+(weak_area, proficiency_level, user_type), and the model is only asked for
+the short, personal parts: the summary, the weekly goal, the goal-aligned
+tasks and the success metrics.
+
+Finished plans are cached in ``plan_cache`` under a signature of the
+inputs that shape them, so learners with the same profile get their plan
+without another model call.
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional
+
+from llm_scheduler import QuotaExceededError
+from text_compression import decode_text, encode_text
+
+WEAK_AREAS = ["grammar", "vocabulary", "organization", "development", "language_use"]
+PROFICIENCY_LEVELS = ["beginner", "intermediate", "advanced"]
+USER_TYPES = ["toefl", "general", "academic", "business"]
+
+# Cached plans older than this are regenerated
+PLAN_CACHE_TTL_DAYS = int(os.getenv("PLAN_CACHE_TTL_DAYS", "30"))
+
+# Two tasks per (area, level): the first pair introduces the area, the second builds on it
+AREA_TASKS = {
+    "grammar": {
+        "beginner": (
+            ["Review subject-verb agreement and simple tenses (15 minutes)",
+             "Correct 10 sentences with common tense errors (15 minutes)"],
+            ["Practice forming questions and negatives in each tense (15 minutes)",
+             "Find and fix the grammar errors in your last writing sample (15 minutes)"],
+        ),
+        "intermediate": (
+            ["Review compound and complex sentence structures (15 minutes)",
+             "Combine 10 pairs of simple sentences using conjunctions (20 minutes)"],
+            ["Practice relative clauses and correct comma usage (15 minutes)",
+             "Edit a paragraph for run-on sentences and fragments (20 minutes)"],
+        ),
+        "advanced": (
+            ["Study conditional and subjunctive forms in formal writing (15 minutes)",
+             "Rewrite 8 sentences using inversion and participle clauses (20 minutes)"],
+            ["Review article and preposition use in academic phrases (15 minutes)",
+             "Proofread a model essay and explain each correction (20 minutes)"],
+        ),
+    },
+    "vocabulary": {
+        "beginner": (
+            ["Learn 15 common academic words with example sentences (15 minutes)",
+             "Match words with synonyms and write one sentence for each (15 minutes)"],
+            ["Review yesterday's words with flashcards (10 minutes)",
+             "Replace basic words like 'good' and 'bad' in a paragraph (20 minutes)"],
+        ),
+        "intermediate": (
+            ["Study 15 topic-specific words for technology and education (15 minutes)",
+             "Practice common collocations such as 'make a decision' (20 minutes)"],
+            ["Paraphrase 5 sentences from a model essay (20 minutes)",
+             "Build a personal list of transition words and phrases (15 minutes)"],
+        ),
+        "advanced": (
+            ["Study precise academic verbs such as 'undermine' and 'exacerbate' (15 minutes)",
+             "Rewrite a paragraph to remove repetition and vague wording (20 minutes)"],
+            ["Practice hedging language for balanced arguments (15 minutes)",
+             "Analyze word choice in a high-scoring essay (20 minutes)"],
+        ),
+    },
+    "organization": {
+        "beginner": (
+            ["Study the introduction-body-conclusion structure (15 minutes)",
+             "Write an outline with a main idea and three supporting points (15 minutes)"],
+            ["Practice writing clear topic sentences for 5 prompts (15 minutes)",
+             "Reorder scrambled sentences into a logical paragraph (15 minutes)"],
+        ),
+        "intermediate": (
+            ["Analyze the structure of a model essay paragraph by paragraph (15 minutes)",
+             "Outline two essays with thesis statements and topic sentences (20 minutes)"],
+            ["Practice transitions between paragraphs (15 minutes)",
+             "Reorganize one of your past essays for better flow (20 minutes)"],
+        ),
+        "advanced": (
+            ["Compare block and point-by-point structures for discussion essays (15 minutes)",
+             "Outline an essay that addresses a counterargument (20 minutes)"],
+            ["Practice writing conclusions that synthesize rather than repeat (15 minutes)",
+             "Tighten paragraph unity by removing off-topic sentences (20 minutes)"],
+        ),
+    },
+    "development": {
+        "beginner": (
+            ["Learn the reason-example-explanation pattern (15 minutes)",
+             "Give one reason and one example for 5 simple opinions (15 minutes)"],
+            ["Expand 3 short paragraphs with specific details (20 minutes)",
+             "Answer 'why?' and 'how?' for each of your supporting points (10 minutes)"],
+        ),
+        "intermediate": (
+            ["Study how model essays support each point with evidence (15 minutes)",
+             "Brainstorm personal and general examples for 3 prompts (20 minutes)"],
+            ["Develop a thin paragraph into a fully supported one (20 minutes)",
+             "Practice explaining how each example supports the thesis (15 minutes)"],
+        ),
+        "advanced": (
+            ["Practice building multi-step arguments with cause and effect (15 minutes)",
+             "Write a paragraph that anticipates and rebuts an objection (20 minutes)"],
+            ["Replace generic examples with specific, vivid ones (15 minutes)",
+             "Evaluate the depth of support in a model essay (20 minutes)"],
+        ),
+    },
+    "language_use": {
+        "beginner": (
+            ["Practice writing sentences of different lengths (15 minutes)",
+             "Join short sentences with 'and', 'but', 'because' and 'so' (15 minutes)"],
+            ["Read a short model text aloud and note sentence patterns (15 minutes)",
+             "Rewrite a paragraph to vary sentence beginnings (15 minutes)"],
+        ),
+        "intermediate": (
+            ["Study sentence variety: simple, compound and complex (15 minutes)",
+             "Rewrite a paragraph mixing three sentence types (20 minutes)"],
+            ["Practice formal register by rewriting informal sentences (15 minutes)",
+             "Improve cohesion with reference words and linking phrases (20 minutes)"],
+        ),
+        "advanced": (
+            ["Study rhetorical devices used in persuasive writing (15 minutes)",
+             "Rewrite sentences for concision without losing meaning (20 minutes)"],
+            ["Practice emphasis with cleft sentences and fronting (15 minutes)",
+             "Polish a past essay for tone and fluency (20 minutes)"],
+        ),
+    },
+}
+
+WORD_COUNTS = {"beginner": 150, "intermediate": 250, "advanced": 350}
+
+WRITING_PRACTICE = {
+    "toefl": "Write a {words}-word TOEFL independent essay focusing on {area} (30 minutes)",
+    "academic": "Write a {words}-word academic paragraph with a clear claim, focusing on {area} (25 minutes)",
+    "general": "Write a {words}-word email or blog post focusing on {area} (25 minutes)",
+    "business": "Write a {words}-word business email or short report focusing on {area} (25 minutes)",
+}
+
+REQUIRED_DAY_FIELDS = ["day", "title", "focus_area", "tasks", "learning_objective", "estimated_time"]
+REQUIRED_PLAN_FIELDS = ["plan_title", "plan_summary", "daily_tasks", "weekly_goal", "success_metrics"]
+
+def area_label(area: str) -> str:
+    return area.replace("_", " ")
+
+def normalize_weak_areas(weak_areas: List[str]) -> List[str]:
+    """Map assessment weak areas onto the template library, keeping their order."""
+    areas = []
+    for area in weak_areas:
+        key = str(area).strip().lower().replace(" ", "_")
+        if key in AREA_TASKS and key not in areas:
+            areas.append(key)
+    for fallback in ["grammar", "development"]:
+        if len(areas) >= 2:
+            break
+        if fallback not in areas:
+            areas.append(fallback)
+    return areas
+
+def normalize_level(level: Optional[str]) -> str:
+    level = (level or "").strip().lower()
+    return level if level in PROFICIENCY_LEVELS else "intermediate"
+
+def normalize_user_type(user_type: Optional[str]) -> str:
+    user_type = (user_type or "").strip().lower()
+    return user_type if user_type in USER_TYPES else "general"
+
+def build_day_templates(area: str, level: str, user_type: str) -> List[Dict]:
+    """The introductory and progressive day for one weak area."""
+    intro_tasks, progress_tasks = AREA_TASKS[area][level]
+    practice = WRITING_PRACTICE[user_type].format(words=WORD_COUNTS[level], area=area_label(area))
+    label = area_label(area)
+    return [
+        {
+            "title": f"Focus on {label.title()}",
+            "focus_area": area,
+            "tasks": intro_tasks + [practice],
+            "learning_objective": f"Understand and apply core {label} skills at the {level} level",
+            "estimated_time": "60 minutes"
+        },
+        {
+            "title": f"Strengthen {label.title()}",
+            "focus_area": area,
+            "tasks": progress_tasks + [practice],
+            "learning_objective": f"Build on the previous day's {label} practice",
+            "estimated_time": "60 minutes"
+        },
+    ]
+
+def validate_day(day: Dict):
+    missing = [field for field in REQUIRED_DAY_FIELDS if field not in day]
+    if missing:
+        raise ValueError(f"Day template missing fields: {missing}")
+    if not day["tasks"] or not all(isinstance(task, str) and task for task in day["tasks"]):
+        raise ValueError(f"Day {day['day']} has invalid tasks")
+
+def validate_plan(plan: Dict):
+    missing = [field for field in REQUIRED_PLAN_FIELDS if field not in plan]
+    if missing:
+        raise ValueError(f"Plan missing fields: {missing}")
+    if [day["day"] for day in plan["daily_tasks"]] != list(range(1, 8)):
+        raise ValueError("Plan must cover days 1 to 7 in order")
+    for day in plan["daily_tasks"]:
+        validate_day(day)
+
+# Library of day templates indexed by (weak_area, proficiency_level, user_type)
+TEMPLATE_LIBRARY = {
+    (area, level, user_type): build_day_templates(area, level, user_type)
+    for area in WEAK_AREAS for level in PROFICIENCY_LEVELS for user_type in USER_TYPES
+}
+
+for _templates in TEMPLATE_LIBRARY.values():
+    for _template in _templates:
+        validate_day({"day": 1, **_template})
+
+def build_base_plan(weak_areas: List[str], level: str, user_type: str, learning_goals: List[str]) -> Dict:
+    """Assemble a complete plan from templates, with generic text for the personal parts."""
+    primary, secondary = weak_areas[0], weak_areas[1]
+    goals = ", ".join(learning_goals) if learning_goals else "your writing goals"
+    practice = WRITING_PRACTICE[user_type].format(words=WORD_COUNTS[level], area="your goals")
+
+    days = copy.deepcopy(TEMPLATE_LIBRARY[(primary, level, user_type)] + TEMPLATE_LIBRARY[(secondary, level, user_type)])
+    days += [
+        {
+            "title": "Goal-Aligned Practice",
+            "focus_area": goals,
+            "tasks": [
+                f"Review what you have learned and how it relates to {goals} (15 minutes)",
+                f"Study a model text that demonstrates {goals} (15 minutes)",
+                practice
+            ],
+            "learning_objective": "Apply improvements to personal goals",
+            "estimated_time": "60 minutes"
+        },
+        {
+            "title": "Integration & Practice",
+            "focus_area": f"{area_label(primary)} and {area_label(secondary)}",
+            "tasks": [
+                f"Edit a past essay for both {area_label(primary)} and {area_label(secondary)} (20 minutes)",
+                "Outline a new essay using this week's techniques (10 minutes)",
+                WRITING_PRACTICE[user_type].format(words=WORD_COUNTS[level], area="all improvements")
+            ],
+            "learning_objective": "Synthesize all learning",
+            "estimated_time": "60 minutes"
+        },
+        {
+            "title": "Review & Assessment",
+            "focus_area": "evaluation and next steps",
+            "tasks": [
+                "Review the week's writing and mark recurring issues (15 minutes)",
+                "Complete a timed practice assessment (30 minutes)",
+                "Set goals for next week based on your results (15 minutes)"
+            ],
+            "learning_objective": "Evaluate progress and plan continuation",
+            "estimated_time": "60 minutes"
+        },
+    ]
+
+    return {
+        "plan_title": "Your Personalized 7-Day Writing Improvement Plan",
+        "plan_summary": f"A focused plan to improve your {area_label(primary)} and {area_label(secondary)} skills",
+        "daily_tasks": [{"day": index + 1, **day} for index, day in enumerate(days)],
+        "weekly_goal": f"Make measurable progress in {area_label(primary)} and {area_label(secondary)}",
+        "success_metrics": [
+            "Complete all daily tasks",
+            f"Fewer {area_label(primary)} issues in the day 7 assessment than in your first essay",
+            f"Apply {area_label(secondary)} techniques in every writing practice"
+        ]
+    }
+
+def get_plan_personalization_prompt(weak_areas: List[str], level: str, user_type: str, learning_goals: List[str]) -> str:
+    goals = ", ".join(learning_goals) if learning_goals else "general writing improvement"
+
+    return f"""You are an expert English writing instructor personalizing a 7-day writing plan.
+The daily exercises are already written; provide only the personal parts.
+
+Student Profile:
+- Focus Area: {user_type}
+- Proficiency Level: {level}
+- Weak Areas: {", ".join(area_label(area) for area in weak_areas)}
+- Learning Goals: {goals}
+
+Respond with ONLY a JSON object in this exact format:
+{{
+    "plan_summary": "1-2 sentences on what this plan will achieve for this student",
+    "weekly_goal": "One sentence primary objective for the week",
+    "goal_tasks": [
+        "Goal-specific task 1 (15-20 minutes)",
+        "Goal-specific task 2 (15-20 minutes)"
+    ],
+    "success_metrics": [
+        "Measurable outcome 1",
+        "Measurable outcome 2",
+        "Measurable outcome 3"
+    ]
+}}
+
+Return ONLY the JSON object with no additional text or formatting."""
+
+def _clean_string(value, max_length: int = 300) -> Optional[str]:
+    if isinstance(value, str) and value.strip():
+        return value.strip()[:max_length]
+    return None
+
+def _clean_list(value, max_items: int) -> List[str]:
+    # A bare string would otherwise be iterated character by character
+    if not isinstance(value, list):
+        return []
+    return [item for item in map(_clean_string, value) if item][:max_items]
+
+def apply_personalization(plan: Dict, response_text: str) -> Dict:
+    """Merge the model's personal parts into a template plan.
+
+    Fields that are missing or malformed keep their template text; a response
+    that isn't a JSON object raises ValueError.
+    """
+    if response_text.startswith("```json") or response_text.startswith('```'):
+        response_text = response_text.replace('```json', '').replace('```', '').strip()
+
+    delta = json.loads(response_text)
+    if not isinstance(delta, dict):
+        raise ValueError("Personalization response is not an object")
+
+    for field in ["plan_summary", "weekly_goal"]:
+        value = _clean_string(delta.get(field))
+        if value:
+            plan[field] = value
+
+    goal_tasks = _clean_list(delta.get("goal_tasks"), 2)
+    if goal_tasks:
+        plan["daily_tasks"][4]["tasks"] = goal_tasks + plan["daily_tasks"][4]["tasks"][-1:]
+
+    metrics = _clean_list(delta.get("success_metrics"), 3)
+    if metrics:
+        plan["success_metrics"] = metrics
+
+    validate_plan(plan)
+    return plan
+
+def get_profile_signature(weak_areas: List[str], level: str, user_type: str, learning_goals: List[str]) -> str:
+    """Hash of everything that shapes a plan; profiles with the same signature share one."""
+    key = json.dumps({
+        "weak_areas": weak_areas[:2],
+        "level": level,
+        "user_type": user_type,
+        "learning_goals": sorted(goal.strip().lower() for goal in learning_goals)
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def init_plan_cache(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS plan_cache (
+            signature TEXT PRIMARY KEY,
+            plan_data TEXT, -- JSON object
+            hits INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def get_cached_plan(conn: sqlite3.Connection, signature: str) -> Optional[Dict]:
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT plan_data FROM plan_cache
+        WHERE signature = ? AND created_at > datetime('now', ?)
+    """, (signature, f"-{PLAN_CACHE_TTL_DAYS} days"))
+    result = cursor.fetchone()
+    if not result:
+        return None
+
+    cursor.execute("UPDATE plan_cache SET hits = hits + 1 WHERE signature = ?", (signature,))
+    return json.loads(decode_text(result[0]))
+
+def store_cached_plan(conn: sqlite3.Connection, signature: str, plan: Dict):
+    conn.execute("""
+        INSERT OR REPLACE INTO plan_cache (signature, plan_data)
+        VALUES (?, ?)
+    """, (signature, encode_text(json.dumps(plan))))
+
+def synthesize_learning_plan(conn: sqlite3.Connection, assessment_data: Dict, learning_goals: List[str],
+                             user_type: str, generate_text: Callable[[str], str], refresh: bool = False) -> Dict:
+    """Return a plan for this profile from the cache, or build and personalize one.
+
+    ``generate_text`` sends a prompt to the model and returns its text; if the
+    model call or its response fails the template plan is still returned,
+    uncached, so the next request retries the personalization. Running out of
+    quota is not a model failure and is raised to the caller. ``refresh``
+    skips the cache lookup.
+    """
+    weak_areas = normalize_weak_areas(assessment_data.get("weak_areas", []))
+    level = normalize_level(assessment_data.get("proficiency_level"))
+    user_type = normalize_user_type(user_type)
+
+    signature = get_profile_signature(weak_areas, level, user_type, learning_goals)
+    cached_plan = None if refresh else get_cached_plan(conn, signature)
+    if cached_plan:
+        print(f"Using cached learning plan for signature: {signature[:12]}")
+        return cached_plan
+
+    plan = build_base_plan(weak_areas, level, user_type, learning_goals)
+    prompt = get_plan_personalization_prompt(weak_areas, level, user_type, learning_goals)
+    try:
+        plan = apply_personalization(plan, generate_text(prompt))
+    except QuotaExceededError:
+        raise
+    except Exception as e:
+        print(f"Plan personalization failed, using template plan: {e}")
+        return build_base_plan(weak_areas, level, user_type, learning_goals)
+
+    store_cached_plan(conn, signature, plan)
+    return plan
@@ -0,0 +1,220 @@
+"""Retention and compaction for the submissions table.
+
+Every graded essay is stored in full, so toefl.db only ever grows. The
+retention job moves submissions that fall outside the policy into
+``submissions_archive`` as compressed blobs, then hands the freed pages
+back to the filesystem with an incremental vacuum. Work is done in small
+batches with a pause between them so live requests never wait long on the
+write lock.
+
+Policy (environment variables):
+    RETENTION_KEEP_PER_USER      newest submissions kept per user (0 = no limit)
+    RETENTION_ARCHIVE_AFTER_DAYS archive submissions older than this (0 = never)
+    RETENTION_INTERVAL_SECONDS   how often the background job runs
+    RETENTION_BATCH_SIZE         rows moved per transaction
+    RETENTION_BATCH_PAUSE        seconds to sleep between batches
+    RETENTION_VACUUM_PAGES       pages freed per incremental vacuum step
+"""
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional
+
+import schema
+from text_compression import decode_text
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DB_PATH = 'toefl.db'
+
+KEEP_PER_USER = int(os.getenv("RETENTION_KEEP_PER_USER", "50"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("RETENTION_ARCHIVE_AFTER_DAYS", "90"))
+INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "200"))
+BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "256"))
+
+def compress_payload(data: bytes):
+    """Compress with zstd when available, falling back to gzip."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=9)
+
+def decompress_payload(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-archived submissions")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+def init_archive(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS submissions_archive (
+            id INTEGER PRIMARY KEY, -- id of the original submission
+            question_id TEXT,
+            user_id TEXT,
+            timestamp DATETIME,
+            codec TEXT, -- "zstd" or "gzip"
+            payload BLOB, -- compressed JSON of user_answer and feedback
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Switch the database to incremental auto-vacuum.
+
+    Changing the mode on an existing database only takes effect after a full
+    VACUUM, which is done once here; later runs only do incremental steps.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("Enabled incremental auto-vacuum")
+
+def convert_to_incremental_vacuum(db_path: str = DB_PATH):
+    """Run the one-time conversion on its own connection (slow on large databases)."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        enable_incremental_vacuum(conn)
+    finally:
+        conn.close()
+
+def find_expired_ids(conn: sqlite3.Connection, keep_per_user: int = KEEP_PER_USER,
+                     archive_after_days: int = ARCHIVE_AFTER_DAYS) -> List[int]:
+    """Return the ids of all submissions outside the retention policy, in id order.
+
+    Computed once per pass with indexed queries, each a short statement of
+    its own, so live writes are never held up by a long scan.
+    """
+    expired = set()
+    if archive_after_days > 0:
+        expired.update(row[0] for row in conn.execute(
+            "SELECT id FROM submissions WHERE timestamp < datetime('now', ?)", (f"-{archive_after_days} days",)
+        ))
+    if keep_per_user > 0:
+        # Anonymous submissions (no user_id) are only subject to the age limit
+        users = conn.execute("""
+            SELECT user_id FROM submissions WHERE user_id IS NOT NULL
+            GROUP BY user_id HAVING COUNT(*) > ?
+        """, (keep_per_user,)).fetchall()
+        for (user_id,) in users:
+            expired.update(row[0] for row in conn.execute("""
+                SELECT id FROM submissions WHERE user_id = ?
+                ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?
+            """, (user_id, keep_per_user)))
+    return sorted(expired)
+
+def archive_batch(conn: sqlite3.Connection, ids: List[int]) -> int:
+    """Move one batch of submissions into the archive in a single transaction."""
+    placeholders = ", ".join("?" for _ in ids)
+    rows = conn.execute(f"""
+        SELECT id, question_id, user_id, timestamp, user_answer, feedback
+        FROM submissions WHERE id IN ({placeholders})
+    """, ids).fetchall()
+
+    archived = []
+    for submission_id, question_id, user_id, timestamp, user_answer, feedback in rows:
+        payload = json.dumps({"user_answer": decode_text(user_answer), "feedback": decode_text(feedback)}).encode("utf-8")
+        codec, blob = compress_payload(payload)
+        archived.append((submission_id, question_id, user_id, timestamp, codec, blob))
+
+    with conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO submissions_archive
+            (id, question_id, user_id, timestamp, codec, payload)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, archived)
+        conn.execute(f"DELETE FROM submissions WHERE id IN ({placeholders})", ids)
+    return len(archived)
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = VACUUM_PAGES, pause: float = BATCH_PAUSE) -> int:
+    """Release free pages in small steps; returns the number of pages freed."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # incremental_vacuum is a no-op until enable_incremental_vacuum has succeeded
+        return 0
+    freed = 0
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free_pages:
+        conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free_pages:
+            # Nothing was released (e.g. another connection holds a read lock)
+            break
+        freed += free_pages - remaining
+        free_pages = remaining
+        time.sleep(pause)
+    return freed
+
+def run_retention(db_path: str = DB_PATH, keep_per_user: int = KEEP_PER_USER,
+                  archive_after_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = BATCH_SIZE,
+                  pause: float = BATCH_PAUSE) -> Dict[str, int]:
+    """Run one retention pass: archive expired submissions, then vacuum."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        # Also run by hand, possibly on a database the server has not migrated yet
+        schema.init_schema(conn)
+        init_archive(conn)
+        archived = 0
+        expired_ids = find_expired_ids(conn, keep_per_user, archive_after_days)
+        for start in range(0, len(expired_ids), batch_size):
+            archived += archive_batch(conn, expired_ids[start:start + batch_size])
+            time.sleep(pause)
+
+        freed_pages = incremental_vacuum(conn, pause=pause)
+        if archived or freed_pages:
+            print(f"Retention archived {archived} submissions and freed {freed_pages} pages")
+        return {"archived": archived, "freed_pages": freed_pages}
+    finally:
+        conn.close()
+
+def iter_archived_submissions(conn: sqlite3.Connection, user_id: Optional[str] = None,
+                               page_size: int = BATCH_SIZE) -> Iterator[Dict]:
+    """Yield archived submissions, decompressed back into submission rows, in id order."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'submissions_archive'").fetchone():
+        return
+    last_id = 0
+    while True:
+        rows = conn.execute(f"""
+            SELECT id, question_id, user_id, timestamp, codec, payload
+            FROM submissions_archive
+            WHERE id > ? {'AND user_id = ?' if user_id is not None else ''}
+            ORDER BY id LIMIT ?
+        """, (last_id, user_id, page_size) if user_id is not None else (last_id, page_size)).fetchall()
+        if not rows:
+            return
+        for submission_id, question_id, row_user_id, timestamp, codec, payload in rows:
+            yield {
+                "id": submission_id,
+                "question_id": question_id,
+                "user_id": row_user_id,
+                "timestamp": timestamp,
+                **json.loads(decompress_payload(codec, payload))
+            }
+        last_id = rows[-1][0]
+
+async def retention_loop(interval: int = INTERVAL_SECONDS):
+    """Background task that runs the retention pass off the event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        # The full VACUUM can take a while, so it runs here rather than on the startup path
+        await loop.run_in_executor(None, convert_to_incremental_vacuum)
+    except sqlite3.Error as e:
+        print(f"Could not enable incremental auto-vacuum: {e}")
+    while True:
+        try:
+            await loop.run_in_executor(None, run_retention)
+        except sqlite3.Error as e:
+            print(f"Database error in retention job: {e}")
+        await asyncio.sleep(interval)
+
+if __name__ == "__main__":
+    convert_to_incremental_vacuum()
+    print(run_retention())
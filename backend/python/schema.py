@@ -0,0 +1,120 @@
+"""Table definitions for toefl.db.
+
+``init_schema`` creates every WritePath table and adds columns that older
+databases are missing. The API server, the export/import CLI and the
+retention job all call it, so each of them works on a fresh or
+not-yet-migrated database.
+"""
+import sqlite3
+
+def init_schema(conn: sqlite3.Connection):
+    """Create missing tables and columns; safe to call on every start."""
+    cursor = conn.cursor()
+    
+    # Takes effect at once on a new database; existing ones are converted by the retention job
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
+    # Readers (exports, the retention job) don't block the writes of live requests
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
+    # Original submissions table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id TEXT,
+            user_id TEXT,
+            user_answer TEXT,
+            feedback TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Databases created before submissions were linked to users lack user_id
+    cursor.execute("PRAGMA table_info(submissions)")
+    if "user_id" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE submissions ADD COLUMN user_id TEXT")
+    
+    # Used by the retention job to find old submissions and each user's newest ones
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_timestamp ON submissions (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_user_timestamp ON submissions (user_id, timestamp)")
+    
+    # User profiles table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            id TEXT PRIMARY KEY,
+            user_type TEXT NOT NULL,
+            proficiency_level TEXT,
+            target_score INTEGER,
+            learning_goals TEXT, -- JSON array
+            sample_writing TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Learning paths table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS learning_paths (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            assessment_id INTEGER, -- assessment the plan was built from
+            path_data TEXT, -- JSON object
+            progress TEXT, -- JSON object
+            weak_areas TEXT, -- JSON array
+            recommendations TEXT, -- JSON array
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_profiles (id)
+        )
+    """)
+    
+    # Databases created before plans were linked to assessments lack assessment_id
+    cursor.execute("PRAGMA table_info(learning_paths)")
+    if "assessment_id" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE learning_paths ADD COLUMN assessment_id INTEGER")
+    
+    # Practice sessions table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS practice_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            session_type TEXT,
+            questions_attempted TEXT, -- JSON array
+            completion_status TEXT,
+            performance_metrics TEXT, -- JSON object
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_profiles (id)
+        )
+    """)
+    
+    # Expanded questions bank
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS questions_bank (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT,
+            difficulty_level TEXT,
+            question_text TEXT,
+            reference_answer TEXT,
+            learning_objectives TEXT, -- JSON array
+            tags TEXT, -- JSON array
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Assessment results table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS assessment_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            assessment_type TEXT,
+            sample_writing TEXT,
+            analysis_result TEXT, -- JSON object
+            proficiency_score INTEGER,
+            weak_areas TEXT, -- JSON array
+            recommendations TEXT, -- JSON array
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_profiles (id)
+        )
+    """)
+    
+    conn.commit()
@@ -0,0 +1,26 @@
+"""Fast JSON serialization for API responses.
+
+Plans and assessment results are stored as JSON text. Returning them the
+usual way means parsing that text into dicts, running the dicts through
+FastAPI's ``jsonable_encoder`` and encoding them again. ``stored_json``
+instead wraps the stored text in an ``orjson.Fragment``, which orjson
+copies into the response verbatim, so the document is never decoded.
+orjson versions without ``Fragment`` (before 3.9) fall back to parsing.
+
+Handlers on the fast path return ``ORJSONResponse(content=...)`` directly,
+which skips FastAPI's response-model validation and ``jsonable_encoder``;
+their response models still describe the payload in the OpenAPI schema.
+"""
+from typing import Optional
+
+import orjson
+
+HAS_FRAGMENT = hasattr(orjson, "Fragment")
+
+def stored_json(text: Optional[str], default: str = "null"):
+    """Embed a stored JSON document in a response without re-encoding it."""
+    if not text:
+        text = default
+    if HAS_FRAGMENT:
+        return orjson.Fragment(text)
+    return orjson.loads(text)
@@ -0,0 +1,228 @@
+"""Transparent compression for large text columns.
+
+Essays, feedback, assessment results and 7-day plans are stored as zlib
+BLOBs compressed against a shared preset dictionary. The plan and feedback
+JSON repeats the same keys and phrasing in every row, so priming zlib with
+that vocabulary shrinks even short documents that plain zlib barely helps.
+
+Stored format: one version byte, one dictionary id byte, then the raw
+deflate stream. Values that are still TEXT (rows written before compression
+was enabled, or values too small to be worth compressing) are returned as
+is, so no migration is required; ``compress_existing`` can rewrite old rows
+in place when convenient.
+
+Dictionary id 1 is built in. ``train_dictionary`` builds a better one from
+the rows already in the database and stores it in
+``compression_dictionaries``; new writes then use the newest dictionary
+while old rows keep decoding with the one they were written with.
+
+Usage:
+    python text_compression.py train
+    python text_compression.py compress-existing
+"""
+import sqlite3
+import sys
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Optional, Union
+
+DB_PATH = 'toefl.db'
+
+FORMAT_VERSION = 1
+# Values shorter than this are stored as plain TEXT
+MIN_COMPRESS_LENGTH = 128
+# zlib only uses the last 32KB of a preset dictionary
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Columns holding large, repetitive text
+COMPRESSED_COLUMNS = {
+    "submissions": ["user_answer", "feedback"],
+    "user_profiles": ["sample_writing"],
+    "assessment_results": ["sample_writing", "analysis_result"],
+    "learning_paths": ["path_data"],
+}
+
+# Vocabulary shared by the stored plan, assessment and feedback JSON. zlib
+# favours the end of the dictionary, so the most common strings come last.
+BUILTIN_DICTIONARY = (
+    'Technology education university career environment society government people '
+    'In conclusion, I believe that For example, However, Furthermore, In addition, On the other hand, '
+    'Firstly, Secondly, Finally, there are several reasons why Do you agree or disagree with the following statement? '
+    '"Brief overview of what this plan will achieve", "Primary objective for the week", '
+    '"Measurable outcome", "Review week\'s progress", "Complete practice assessment", "Plan next steps", '
+    '"Integrated practice task", "Full writing exercise", "Synthesize all learning", '
+    '"Goal-specific task", "Comprehensive writing practice", "Apply improvements to personal goals", '
+    '"Consolidate secondary improvements", "Address secondary weakness", "Build on day 1 progress", '
+    '"Progressive task", "Practice writing exercises", "Review grammar rules", "Complete writing prompt", '
+    '"Show improvement in weak areas", "Complete daily tasks", "Improve overall writing proficiency", '
+    '"strengths": ["Shows effort in writing", "Attempts to express ideas"], '
+    '"detailed_analysis": {"grammar": "", "vocabulary": "", "organization": "", "development": "", "language_use": ""}, '
+    '"recommendations": ["Focus on grammar practice", "Expand vocabulary range", "Practice organizing ideas clearly"], '
+    '"proficiency_score": 15, "proficiency_level": "intermediate", "beginner", "advanced", '
+    '"weak_areas": ["grammar", "vocabulary", "organization", "development", "language_use"], '
+    '{"corrections": ["The AI response format was incorrect."], '
+    '"suggestions": ["Please try again with a different answer.", "Your response should be well-organized, '
+    'typically including an introduction, body paragraphs with supporting details, and a conclusion. '
+    'Use appropriate academic vocabulary and tone. Practice structuring paragraphs and linking ideas logically '
+    'to ensure coherence and cohesion in your writing. You need to develop your ideas fully with specific '
+    'reasons and examples."], "score": '
+    '{"plan_title": "Your Personalized 7-Day Writing Improvement Plan", '
+    '"plan_summary": "A focused plan to improve your grammar, vocabulary skills", '
+    '"daily_tasks": [{"day": 1, "title": "Day 1: Writing Practice", "focus_area": "grammar", '
+    '"tasks": ["Specific task 1 (15-20 minutes)", "Specific task 2 (15-20 minutes)", "Writing practice (20-30 minutes)"], '
+    '"learning_objective": "Improve grammar", "estimated_time": "60 minutes"}, '
+    '{"day": 2, "title": "Day 2: Writing Practice", "focus_area": "vocabulary", "tasks": ["'
+).encode("utf-8")
+
+_dictionaries: Dict[int, bytes] = {1: BUILTIN_DICTIONARY}
+_active_dictionary_id = 1
+
+def init_dictionaries(conn: sqlite3.Connection):
+    """Create the dictionary table and load any trained dictionaries."""
+    global _active_dictionary_id
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS compression_dictionaries (
+            id INTEGER PRIMARY KEY,
+            data BLOB,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    for dictionary_id, data in conn.execute("SELECT id, data FROM compression_dictionaries ORDER BY id"):
+        _dictionaries[dictionary_id] = bytes(data)
+        _active_dictionary_id = max(_active_dictionary_id, dictionary_id)
+
+def _get_dictionary(dictionary_id: int) -> bytes:
+    if dictionary_id not in _dictionaries:
+        # Written by another process after we loaded our dictionaries
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            init_dictionaries(conn)
+        finally:
+            conn.close()
+    if dictionary_id not in _dictionaries:
+        raise ValueError(f"Unknown compression dictionary: {dictionary_id}")
+    return _dictionaries[dictionary_id]
+
+def encode_text(text: Optional[str]) -> Union[str, bytes, None]:
+    """Compress ``text`` for storage, or return it unchanged if that doesn't pay off."""
+    if text is None or len(text) < MIN_COMPRESS_LENGTH:
+        return text
+
+    data = text.encode("utf-8")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=_dictionaries[_active_dictionary_id])
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) + 2 >= len(data):
+        return text
+    return bytes([FORMAT_VERSION, _active_dictionary_id]) + compressed
+
+def decode_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """Return the text for a stored column value, decompressing it if needed."""
+    if value is None or isinstance(value, str):
+        return value
+
+    version, dictionary_id = value[0], value[1]
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compressed text version: {version}")
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=_get_dictionary(dictionary_id))
+    return (decompressor.decompress(value[2:]) + decompressor.flush()).decode("utf-8")
+
+def build_dictionary(samples: Iterable[str], size: int = MAX_DICTIONARY_SIZE) -> bytes:
+    """Build a preset dictionary from the fragments that recur most across samples.
+
+    Documents are split into JSON-ish fragments; fragments seen in more than
+    one document are kept, ordered so the most frequent end up last, where
+    zlib can reach them with the shortest distances.
+    """
+    counts = Counter()
+    for sample in samples:
+        fragments = set()
+        for line in sample.replace('", "', '"\n"').replace(', "', ',\n"').splitlines():
+            fragment = line.strip()
+            if len(fragment) >= 4:
+                fragments.add(fragment)
+        counts.update(fragments)
+
+    dictionary = b""
+    for fragment, count in counts.most_common():
+        if count < 2:
+            break
+        encoded = fragment.encode("utf-8") + b" "
+        if len(dictionary) + len(encoded) > size:
+            break
+        dictionary = encoded + dictionary
+    return dictionary
+
+def train_dictionary(conn: sqlite3.Connection, sample_limit: int = 2000) -> Optional[int]:
+    """Train a dictionary on stored rows and make it the one used for new writes."""
+    global _active_dictionary_id
+    init_dictionaries(conn)
+
+    samples = []
+    for table, columns in COMPRESSED_COLUMNS.items():
+        for column in columns:
+            for (value,) in conn.execute(f"""
+                SELECT {column} FROM {table} WHERE {column} IS NOT NULL
+                ORDER BY id DESC LIMIT ?
+            """, (sample_limit,)):
+                samples.append(decode_text(value))
+
+    trained = build_dictionary(samples)
+    if not trained:
+        print("Not enough data to train a compression dictionary")
+        return None
+    # Keep the built-in vocabulary as a fallback when the sample is small
+    dictionary = (BUILTIN_DICTIONARY + trained)[-MAX_DICTIONARY_SIZE:]
+
+    dictionary_id = max(_dictionaries) + 1
+    if dictionary_id > 255:
+        raise ValueError("Dictionary ids are stored in a single byte")
+    conn.execute("INSERT INTO compression_dictionaries (id, data) VALUES (?, ?)", (dictionary_id, dictionary))
+    conn.commit()
+    _dictionaries[dictionary_id] = dictionary
+    _active_dictionary_id = dictionary_id
+    print(f"Trained compression dictionary {dictionary_id} ({len(dictionary)} bytes) on {len(samples)} samples")
+    return dictionary_id
+
+def compress_existing(conn: sqlite3.Connection, batch_size: int = 500) -> int:
+    """Rewrite uncompressed rows with the active dictionary; returns rows changed."""
+    init_dictionaries(conn)
+    changed = 0
+    for table, columns in COMPRESSED_COLUMNS.items():
+        last_id = None
+        while True:
+            rows = conn.execute(f"""
+                SELECT id, {', '.join(columns)} FROM {table}
+                WHERE {'id > ?' if last_id is not None else '1'}
+                ORDER BY id LIMIT ?
+            """, ((last_id, batch_size) if last_id is not None else (batch_size,))).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                encoded = [encode_text(value) if isinstance(value, str) else value for value in row[1:]]
+                if encoded != list(row[1:]):
+                    updates.append((*encoded, row[0]))
+            if updates:
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                conn.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", updates)
+                conn.commit()
+                changed += len(updates)
+            last_id = rows[-1][0]
+    print(f"Compressed {changed} existing rows")
+    return changed
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("train", "compress-existing"):
+        print(__doc__)
+        sys.exit(1)
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if command == "train":
+            train_dictionary(conn)
+        else:
+            compress_existing(conn)
+    finally:
+        conn.close()